@@ -6,13 +6,56 @@ import subprocess
 import re
 import argparse
 import os
+import mmap
+import time
+import sqlite3
+import hashlib
+from multiprocessing import Pool
 from datetime import timedelta
 from datetime import date
 
 # configuration
 use_git_root_for_command_db_file = True
+# cache the source to object mapping next to the compile command db
+use_command_db_index_file = True
+command_db_index_suffix = ".index"
+# bumped whenever the parsed mapping changes, older index files are rebuilt
+command_db_index_version = 3
 float_precision = 2
 float_precision = str(float_precision)
+# state file of the incremental mode, stored in the git dir if no state file
+# is given, one per analysed directory
+state_filename = "per-module-metrics-state-{}.json"
+# content cache, stored in the git dir if no cache file is given
+content_cache_filename = "per-module-metrics-cache.sqlite"
+default_content_cache_size = 100000
+# source code file pattern
+sourcecode_pattern = r'.*\.h$|.*\.hpp$|.*\.c$|.*\.cpp$'
+
+# identifier pattern:
+# - consists of alpha-numeric characters and underscores
+# - must start with a letter or underscore (no digit)
+# this does detect text in comments as symbols
+identifier_pattern = re.compile(rb'[a-zA-Z_][a-zA-Z0-9_]*')
+# filter out C++ keywords: https://en.cppreference.com/w/cpp/keyword
+cpp_keywords = frozenset(keyword.encode() for keyword in [
+    "alignas", "alignof", "and", "and_eq", "asm", "atomic_cancel",
+    "atomic_commit", "atomic_noexcept", "auto", "bitand", "bitor", "bool",
+    "break", "case", "catch", "char", "char8_t", "char16_t", "char32_t",
+    "class", "compl", "concept", "const", "consteval", "constexpr",
+    "const_cast", "continue", "co_await", "co_return", "co_yield",
+    "decltype", "default", "delete", "do", "double", "dynamic_cast",
+    "else", "enum", "explicit", "export", "extern", "false", "float",
+    "for", "friend", "goto", "if", "inline", "int", "long", "mutable",
+    "namespace", "new", "noexcept", "not", "not_eq", "nullptr", "operator",
+    "or", "or_eq", "private", "protected", "public", "reflexpr",
+    "register", "reinterpret_cast", "requires", "return", "short",
+    "signed", "sizeof", "static", "static_assert", "static_cast", "struct",
+    "switch", "synchronized", "template", "this", "thread_local", "throw",
+    "true", "try", "typedef", "typeid", "typename", "union", "unsigned",
+    "using", "virtual", "void", "volatile", "wchar_t", "while", "xor",
+    "xor_eq"
+])
 
 
 # helper functions
@@ -27,6 +70,27 @@ def run_command(command, multiline_output=True):
     return text.split("\n") if multiline_output else text.strip()
 
 
+def stream_command(command, separator):
+    # yields the output of the command split at the separator, record by
+    # record while the command is still running instead of buffering the whole
+    # output; a record starts at a line beginning with the separator
+    command = command if isinstance(command, list) else command.split()
+    process = subprocess.Popen(
+        command,
+        stdout=subprocess.PIPE
+    )
+    record = []
+    for line in process.stdout:
+        line = line.decode()
+        if line.startswith(separator):
+            yield "".join(record)
+            record = [line[len(separator):]]
+        else:
+            record.append(line)
+    yield "".join(record)
+    process.wait()
+
+
 def git_root():
     return run_command("git rev-parse --show-toplevel", multiline_output=False)
 
@@ -40,21 +104,233 @@ def ensure_ending_slash(path):
 
 
 def count_lines(filename):
+    i = 0
     with open(filename, "r", encoding='latin1') as f:
         for i, _ in enumerate(f, 1):
             pass
     return i
 
 
+def count_lines_in(code):
+    # same as `count_lines`, which splits at \n, \r\n and \r
+    lines = code.count(b"\n") + code.count(b"\r") - code.count(b"\r\n")
+    if code and code[-1:] not in (b"\n", b"\r"):
+        lines += 1
+    return lines
+
+
+class GitBlobReader:
+    # reads blobs from the object database through one long-lived
+    # `git cat-file --batch` process
+    def __init__(self):
+        self.process = subprocess.Popen(
+            ['git', 'cat-file', '--batch'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE
+        )
+
+    def read(self, object_id):
+        self.process.stdin.write(object_id.encode() + b"\n")
+        self.process.stdin.flush()
+        header = self.process.stdout.readline().split()
+        if header[-1] == b"missing":
+            raise KeyError(object_id)
+        data = self.process.stdout.read(int(header[2]))
+        # skip the LF terminating the object content
+        self.process.stdout.read(1)
+        return data
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+
+class ContentCache:
+    # persistent cache of the content data (loc, n_all, n_vk) keyed by blob id,
+    # the least recently used entries are evicted beyond `max_entries`
+    def __init__(self, filename, max_entries):
+        self.max_entries = max_entries
+        self.now = time.time()
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS content ("
+            + "blob TEXT PRIMARY KEY, loc INTEGER, n_all INTEGER NOT NULL, "
+            + "n_vk INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS content_last_used ON content (last_used)"
+        )
+
+    def lookup(self, blobs, batch_size=500):
+        blobs = list(blobs)
+        result = {}
+        for i in range(0, len(blobs), batch_size):
+            batch = blobs[i:i + batch_size]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.connection.execute(
+                "SELECT blob, loc, n_all, n_vk FROM content "
+                + "WHERE blob IN (" + placeholders + ")",
+                batch
+            )
+            for blob, loc, n_all, n_vk in rows:
+                result[blob] = (loc, n_all, n_vk)
+            self.connection.execute(
+                "UPDATE content SET last_used = ? "
+                + "WHERE blob IN (" + placeholders + ")",
+                [self.now] + batch
+            )
+        return result
+
+    def store(self, blob, content_data):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO content VALUES (?, ?, ?, ?, ?)",
+            (blob,) + tuple(content_data) + (self.now,)
+        )
+
+    def close(self):
+        self.connection.execute(
+            "DELETE FROM content WHERE blob NOT IN ("
+            + "SELECT blob FROM content ORDER BY last_used DESC LIMIT ?)",
+            (self.max_entries,)
+        )
+        self.connection.commit()
+        self.connection.close()
+
+
 # heavy lifting functions
 def find_source_code_files():
     output = run_command('find . -type f')
-    # source code file pattern
-    pattern = r'.*\.h$|.*\.hpp$|.*\.c$|.*\.cpp$'
 
     # strip first two chars './' added by the find tool
     sourceFiles = [line[2:] for line in output]
-    return list(filter(lambda f: re.fullmatch(pattern, f), sourceFiles))
+    return list(filter(lambda f: re.fullmatch(sourcecode_pattern, f), sourceFiles))
+
+
+# lists the source code files of a revision with their blob ids
+def list_source_code_files(rev):
+    output = run_command([
+        'git', '-c', 'core.quotePath=false', 'ls-tree', '-r', rev
+    ])
+    filenames = []
+    blob_ids = {}
+    for line in output:
+        if not line:
+            continue
+        info, filename = line.split("\t", 1)
+        mode, object_type, object_id = info.split()
+        # skip submodules and symlinks, like `find -type f` does
+        if object_type != "blob" or mode == "120000":
+            continue
+        if re.fullmatch(sourcecode_pattern, filename):
+            filenames.append(filename)
+            blob_ids[filename] = object_id
+    return filenames, blob_ids
+
+
+def iter_compile_commands(filename, chunk_size=1 << 20):
+    # streams the entries of the top-level JSON array one at a time instead
+    # of loading the whole compile command db into memory
+    decoder = json.JSONDecoder()
+    with open(filename, 'r', encoding='latin1') as inputfile:
+        buffer = inputfile.read(chunk_size)
+        pos = 0
+        while buffer:
+            # skip whitespace and the array punctuation between entries
+            while pos < len(buffer) and buffer[pos] in " \t\r\n[,":
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == "]":
+                return
+            try:
+                if pos == len(buffer):
+                    raise ValueError("need more data")
+                entry, pos = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                more = inputfile.read(chunk_size)
+                if not more:
+                    if pos < len(buffer):
+                        raise
+                    return
+                buffer = buffer[pos:] + more
+                pos = 0
+                continue
+            yield entry
+
+
+def parse_compile_arguments(args):
+    # lightweight replacement for argparse, which is too slow for large
+    # compile command dbs: the last `-o` value wins and the `-o value`,
+    # `-ovalue` and `-o=value` forms are supported; `-c` is a flag, the
+    # argument following it is only returned as a guess for the source file
+    object_name = None
+    source_guess = None
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == "-o":
+            i += 1
+            if i < len(args):
+                object_name = args[i]
+        elif arg.startswith("-o"):
+            value = arg[2:]
+            object_name = value[1:] if value.startswith("=") else value
+        elif arg == "-c" and i + 1 < len(args) and not args[i + 1].startswith("-"):
+            source_guess = args[i + 1]
+        i += 1
+    return object_name, source_guess
+
+
+def parse_compile_command_db(compile_command_db_file):
+    # list of (input filename, object name) pairs in db order
+    pairs = []
+    for entry in iter_compile_commands(compile_command_db_file):
+        if "arguments" in entry:
+            args = entry["arguments"]
+        else:
+            args = entry["command"].split()
+        object_name, source_guess = parse_compile_arguments(args)
+        # the source is given by the required `file` field of the entry
+        input_filename = entry.get("file") or source_guess
+        if not object_name or not input_filename:
+            continue
+        input_filename = os.path.normpath(
+            os.path.join(entry["directory"], input_filename))
+        object_name = os.path.normpath(
+            os.path.join(entry["directory"], object_name))
+        pairs.append((input_filename, object_name))
+    return pairs
+
+
+def load_compile_command_db_index(compile_command_db_file):
+    # the index is reused as long as mtime and size of the db are unchanged
+    index_file = compile_command_db_file + command_db_index_suffix
+    stat = os.stat(compile_command_db_file)
+    try:
+        with open(index_file, 'r', encoding='utf-8') as inputfile:
+            index = json.load(inputfile)
+        if (
+            index["version"] == command_db_index_version and
+            index["mtime"] == stat.st_mtime_ns and
+            index["size"] == stat.st_size
+        ):
+            return index["mapping"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    pairs = parse_compile_command_db(compile_command_db_file)
+    try:
+        tmp_file = index_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as outputfile:
+            json.dump({
+                "version": command_db_index_version,
+                "mtime": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "mapping": pairs
+            }, outputfile)
+        os.replace(tmp_file, index_file)
+    except OSError:
+        print("could not write compile command db index", index_file,
+            file=sys.stderr)
+    return pairs
 
 
 def load_mapping_from_compile_command_db():
@@ -67,156 +343,633 @@ def load_mapping_from_compile_command_db():
     # current working dir for path rewriting
     cwd = ensure_ending_slash(os.getcwd())
 
-    # configure argument parser for compile commands
-    parser = argparse.ArgumentParser()
-    parser.add_argument('-o',
-        type=str,
-        required=True,
-        dest='object_name'
-    )
-    parser.add_argument('-c',
-        type=str,
-        required=True,
-        dest='input_file'
-    )
+    if use_command_db_index_file:
+        pairs = load_compile_command_db_index(compile_command_db_file)
+    else:
+        pairs = parse_compile_command_db(compile_command_db_file)
 
     # result dict
     mapping = {}
-
-    with open(compile_command_db_file, 'r', encoding='latin1') as inputfile:
-        compiler_info = json.load(inputfile)
-        commands = [(obj['command'], obj['directory']) for obj in compiler_info]
-        for command, directory in commands:
-            args, _ = parser.parse_known_args(command.split())
-            object_name = os.path.join(directory, args.object_name)
-            input_filename = args.input_file.replace(cwd, "")
-
-            mapping[input_filename] = object_name
+    for input_filename, object_name in pairs:
+        mapping[input_filename.replace(cwd, "")] = object_name
 
     return mapping
 
 
-def get_last_year_revisions(filename):
-    sep = ";"
-    # timestamp of last commit in HEAD
+def last_year_since(rev="HEAD"):
+    # timestamp of last commit in `rev`
     last_commit_unix_timestamp = run_command(
-        "git log --pretty=%at -1",
+        ['git', 'log', '--pretty=%at', '-1', rev],
         multiline_output=False
     )
     last_commit_timestamp = date.fromtimestamp(int(last_commit_unix_timestamp))
     # consider commits since last commit - 365 days
     delta = timedelta(days=-365)
     since = last_commit_timestamp + delta
+    # start the window at local midnight, a plain date would make git use the
+    # current time of day and the window would change between runs
+    return int(time.mktime(since.timetuple()))
+
 
+def get_last_year_revisions(filename, since, rev="HEAD"):
+    commit_sep = "==="
+    sep = ";"
+    # --full-history keeps the side branch commits that the default history
+    # simplification drops, and -c lists the file for a merge only if it
+    # differs from all parents; commits without a listed file are merges
+    # that took the file from one parent, so they are skipped like in
+    # `load_revision_index`
     git_log_command = [
-        'git', 'log', '--pretty=%at' + sep + '%ae',
-        '--since="{}"'.format(since.isoformat()),
-        filename
+        'git', 'log', '--full-history', '-c', '--name-only',
+        '--pretty=format:' + commit_sep + '%at' + sep + '%ae',
+        '--since=@{}'.format(since),
+        rev, '--', filename
     ]
-    revisions = run_command(git_log_command)
-    return [r.split(sep) for r in revisions if r]
-
-
-def get_identifiers_from(filename):
-    # identifier pattern:
-    # - consists of alpha-numeric characters and underscores
-    # - must start with a letter or underscore (no digit)
-    # this does detect text in comments as symbols
-    pattern = r'[a-zA-Z_][a-zA-Z0-9_]*'
-    # filter out C++ keywords: https://en.cppreference.com/w/cpp/keyword
-    keywords = [
-        "alignas", "alignof", "and", "and_eq", "asm", "atomic_cancel",
-        "atomic_commit", "atomic_noexcept", "auto", "bitand", "bitor", "bool",
-        "break", "case", "catch", "char", "char8_t", "char16_t", "char32_t",
-        "class", "compl", "concept", "const", "consteval", "constexpr",
-        "const_cast", "continue", "co_await", "co_return", "co_yield",
-        "decltype", "default", "delete", "do", "double", "dynamic_cast",
-        "else", "enum", "explicit", "export", "extern", "false", "float",
-        "for", "friend", "goto", "if", "inline", "int", "long", "mutable",
-        "namespace", "new", "noexcept", "not", "not_eq", "nullptr", "operator",
-        "or", "or_eq", "private", "protected", "public", "reflexpr",
-        "register", "reinterpret_cast", "requires", "return", "short",
-        "signed", "sizeof", "static", "static_assert", "static_cast", "struct",
-        "switch", "synchronized", "template", "this", "thread_local", "throw",
-        "true", "try", "typedef", "typeid", "typename", "union", "unsigned",
-        "using", "virtual", "void", "volatile", "wchar_t", "while", "xor",
-        "xor_eq"
+    revisions = []
+    for commit in stream_command(git_log_command, commit_sep):
+        lines = commit.split("\n")
+        if any(lines[1:]):
+            revisions.append(lines[0].split(sep))
+    return revisions
+
+
+def resolve_renames(entries, aliases):
+    # maps the `--name-status` entries of a commit to the current paths of the
+    # files, `aliases` maps historic paths to current ones and is updated with
+    # the renames of the commit, so the history has to be walked backwards
+    filenames = []
+    renamed = {}
+    for entry in entries:
+        parts = entry.split("\t")
+        filename = aliases.get(parts[-1], parts[-1])
+        filenames.append(filename)
+        if parts[0].startswith("R") and len(parts) == 3:
+            renamed[parts[1]] = filename
+    aliases.update(renamed)
+    return filenames
+
+
+# walks the history once and maps each changed file (relative to the current
+# directory) to its revisions in the format of `get_last_year_revisions`,
+# extended by the commit timestamp that the window is based on; with
+# `aliases` the files are tracked across renames and keyed by current path
+def load_revision_index(since, revision_range="HEAD", aliases=None):
+    commit_sep = "==="
+    value_sep = ";"
+    # -c lists the files of merge commits that differ from all parents, the
+    # commits of merged side branches are all included, which matches the
+    # `--full-history` walk of `get_last_year_revisions`
+    git_log_command = [
+        'git', '-c', 'core.quotePath=false', 'log',
+        '--name-status' if aliases is not None else '--name-only',
+        '-c', '--relative',
+        '--pretty=format:' + commit_sep + '%at' + value_sep + '%ae' + value_sep + '%ct',
+        '--since=@{}'.format(since),
+        revision_range
     ]
-    code = ""
-    with open(filename, "r", encoding='latin1') as f:
-        for line in f:
-            code += line
-    identifiers = re.findall(pattern, code)
+    if aliases is not None:
+        git_log_command.insert(4, '-M')
+
+    index = {}
+    for commit in stream_command(git_log_command, commit_sep):
+        if not commit:
+            continue
+        lines = commit.split("\n")
+        revision = lines[0].split(value_sep)
+        entries = [line for line in lines[1:] if line]
+        if aliases is not None:
+            filenames = resolve_renames(entries, aliases)
+        else:
+            filenames = entries
+        for filename in filenames:
+            index.setdefault(filename, []).append(revision)
+    return index
+
+
+def load_state(state_file):
+    try:
+        with open(state_file, 'r', encoding='utf-8') as inputfile:
+            state = json.load(inputfile)
+    except (OSError, ValueError):
+        return None
+    if state.get("cwd") != os.getcwd():
+        return None
+    return state
+
+
+def save_state(state_file, state):
+    tmp_file = state_file + ".tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as outputfile:
+        json.dump(state, outputfile)
+    os.replace(tmp_file, state_file)
+
+
+def is_ancestor(commit, head):
+    return subprocess.call(
+        ['git', 'merge-base', '--is-ancestor', commit, head],
+        stderr=subprocess.DEVNULL
+    ) == 0
+
+
+# slides the window of the stored revision index to `since` by dropping the
+# commits that fell out of it and adding the commits since the stored HEAD,
+# returns None if the index has to be rebuilt by a full walk
+def update_revision_index(state, head, since, follow_renames):
+    old_head = state["head"]
+    if since < state["since"] or not is_ancestor(old_head, head):
+        return None
+    if state.get("follow_renames", False) != follow_renames:
+        return None
+
+    aliases = {} if follow_renames else None
+    new_index = load_revision_index(since, old_head + ".." + head, aliases)
+    old_index = state["revisions"]
+
+    # git log orders by commit date, so the new revisions can only be put in
+    # front of the stored ones if they are all younger
+    newest_stored = max(
+        (int(r[2]) for revisions in old_index.values() for r in revisions),
+        default=None
+    )
+    oldest_new = min(
+        (int(r[2]) for revisions in new_index.values() for r in revisions),
+        default=None
+    )
+    if newest_stored is not None and oldest_new is not None \
+            and oldest_new <= newest_stored:
+        return None
+
+    index = {}
+    for filename, revisions in old_index.items():
+        revisions = [r for r in revisions if int(r[2]) >= since]
+        if not revisions:
+            continue
+        # stored files renamed by the new commits move to their new path
+        if aliases:
+            filename = aliases.get(filename, filename)
+        if filename in index:
+            revisions = sorted(
+                index[filename] + revisions,
+                key=lambda r: int(r[2]),
+                reverse=True
+            )
+        index[filename] = revisions
+    for filename, revisions in new_index.items():
+        index[filename] = revisions + index.get(filename, [])
+    return index
+
+
+# blob ids of the tracked files whose working tree content matches the index
+def load_blob_ids():
+    modified = set(run_command([
+        'git', '-c', 'core.quotePath=false', 'ls-files', '-m'
+    ]))
+    blob_ids = {}
+    for line in run_command([
+        'git', '-c', 'core.quotePath=false', 'ls-files', '-s'
+    ]):
+        if not line:
+            continue
+        info, filename = line.split("\t", 1)
+        _, blob, stage = info.split()
+        if stage == "0" and filename not in modified:
+            blob_ids[filename] = blob
+    return blob_ids
+
+
+def default_content_cache_file():
+    git_dir = run_command(
+        "git rev-parse --git-common-dir",
+        multiline_output=False
+    )
+    return os.path.join(git_dir, content_cache_filename)
+
+
+def default_state_file():
+    git_dir = run_command(
+        "git rev-parse --git-common-dir",
+        multiline_output=False
+    )
+    cwd_hash = hashlib.sha1(os.getcwd().encode()).hexdigest()[:12]
+    return os.path.join(git_dir, state_filename.format(cwd_hash))
+
+
+def file_signature(filename):
+    stat = os.stat(filename)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+# content data of the stored files that are unchanged since the last run
+def reusable_content_data(state, head, signatures, mapping):
+    old_head = state["head"]
+    touched = set()
+    if old_head != head:
+        touched = set(run_command([
+            'git', '-c', 'core.quotePath=false', 'diff',
+            '--name-only', '--relative', old_head, head
+        ]))
+
+    content_data = {}
+    for filename, (signature, data) in state["files"].items():
+        if filename in touched or signatures.get(filename) != signature:
+            continue
+        loc, _, _ = data
+        if loc is None and filename in mapping:
+            continue
+        content_data[filename] = tuple(data)
+    return content_data
+
+
+def count_identifiers_in(code):
+    # counts all (lowercased) non-keyword identifiers and those starting
+    # with "vk" in one pass, without collecting the tokens
+    n_all = 0
+    n_vk = 0
+    for match in identifier_pattern.finditer(code):
+        symbol = match.group().lower()
+        if symbol not in cpp_keywords:
+            n_all += 1
+            if symbol.startswith(b"vk"):
+                n_vk += 1
+    return n_all, n_vk
+
+
+def count_identifiers(filename):
+    with open(filename, "rb") as f:
+        try:
+            code = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files can not be mapped and contain no identifiers
+            return 0, 0
+        with code:
+            return count_identifiers_in(code)
+
+
+def calc_history_metrics(revisions):
+    # metric 1: MTBC
+    mtbc = None
+    if len(revisions) >= 2:
+        timestamps = [
+            date.fromtimestamp(int(revision[0])) for revision in revisions
+        ]
+        deltas = []
+        for i in range(1, len(timestamps)):
+            deltas.append((timestamps[i-1] - timestamps[i]).days)
+        mtbc = mean(deltas)
+
+    # metric 2: NoC
+    authors = set([revision[1] for revision in revisions])
+    noc = len(authors) if len(authors) else None
+
+    # metric 3: BF
+    if(mtbc and noc):
+        bf = noc**2 / mtbc
+    else:
+        bf = None
+
+    return mtbc, noc, bf
+
+
+def calc_history_metrics_vectorized(revision_index, filenames):
+    try:
+        import numpy as np
+    except ImportError:
+        print("ERROR - the vectorized mode requires numpy", file=sys.stderr)
+        print("      - install it using pip via 'pip3 install numpy'", file=sys.stderr)
+        sys.exit(1)
+
+    # flat revision arrays grouped by file, in git log order within a group
+    n_files = len(filenames)
+    counts = np.array(
+        [len(revision_index.get(f, ())) for f in filenames],
+        dtype=np.int64
+    )
+    revisions = [r for f in filenames for r in revision_index.get(f, ())]
+    file_ids = np.repeat(np.arange(n_files), counts)
+    timestamps = np.array([int(r[0]) for r in revisions], dtype=np.int64)
+    _, author_ids = np.unique(
+        np.array([r[1] for r in revisions], dtype=str),
+        return_inverse=True
+    )
+
+    # local calendar days like `date.fromtimestamp`, UTC offsets only change
+    # at full quarter hours
+    quarters, quarter_ids = np.unique(timestamps // 900, return_inverse=True)
+    offsets = np.array(
+        [time.localtime(int(q) * 900).tm_gmtoff for q in quarters],
+        dtype=np.int64
+    )
+    days = (timestamps + offsets[quarter_ids]) // 86400
+
+    # metric 1: MTBC, mean of the deltas between consecutive revisions
+    same_file = file_ids[1:] == file_ids[:-1]
+    deltas = (days[:-1] - days[1:])[same_file]
+    delta_sums = np.bincount(
+        file_ids[1:][same_file],
+        weights=deltas,
+        minlength=n_files
+    )
+    has_mtbc = counts >= 2
+    mtbc = np.zeros(n_files)
+    mtbc[has_mtbc] = delta_sums[has_mtbc] / (counts[has_mtbc] - 1)
+
+    # metric 2: NoC, number of unique (file, author) pairs per file
+    n_authors = int(author_ids.max()) + 1 if len(author_ids) else 1
+    pairs = np.unique(file_ids * n_authors + author_ids)
+    noc = np.bincount(pairs // n_authors, minlength=n_files)
+
+    # metric 3: BF
+    has_bf = has_mtbc & (mtbc != 0) & (noc > 0)
+    bf = np.zeros(n_files)
+    bf[has_bf] = noc[has_bf] ** 2 / mtbc[has_bf]
+
     return [
-        symbol.lower()
-        for symbol in identifiers
-        if symbol.lower() not in keywords
+        (
+            float(mtbc[i]) if has_mtbc[i] else None,
+            int(noc[i]) if noc[i] else None,
+            float(bf[i]) if has_bf[i] else None
+        )
+        for i in range(n_files)
     ]
 
 
-def main():
-    # find all files in repo
-    filenames = find_source_code_files()
-    # load compile mapping (returns the last found object name for each input file)
-    mapping = load_mapping_from_compile_command_db()
-
-    # create metric list
-    metrics = []
-
-    for f in filenames:
-        revisions = get_last_year_revisions(f)
-
-        # metric 1: MTBC
-        mtbc = None
-        if len(revisions) >= 2:
-            timestamps = [
-                date.fromtimestamp(int(timestamp)) for timestamp, _ in revisions
-            ]
-            deltas = []
-            for i in range(1, len(timestamps)):
-                deltas.append((timestamps[i-1] - timestamps[i]).days)
-            mtbc = mean(deltas)
-
-        # metric 2: NoC
-        authors = set([author for _, author in revisions])
-        noc = len(authors) if len(authors) else None
-
-        # metric 3: BF
-        if(mtbc and noc):
-            bf = noc**2 / mtbc
-        else:
-            bf = None
-
-        # metric 4: OSpLoC
-        osploc = None
-        if f in mapping:
-            object_name = mapping[f]
-            object_size = os.path.getsize(object_name)
-            loc = count_lines(f)
-            osploc = object_size / loc
-
-        # metric 5: SoVkC
-        identifiers = get_identifiers_from(f)
-        n_all = len(identifiers)
-        n_vk = sum([1 for symbol in identifiers if symbol.startswith("vk")])
-        if n_all and n_vk:
-            sovkc = n_vk / n_all
-        else:
-            sovkc = None
+def calc_content_data(filename, with_loc):
+    loc = count_lines(filename) if with_loc else None
+    n_all, n_vk = count_identifiers(filename)
+    return loc, n_all, n_vk
+
 
-        metrics.append([
-            f,
-            "{:d}".format(int(mtbc)) if mtbc else None,
-            "{:d}".format(int(noc)) if noc else None,
-            "{:.{prec}f}".format(bf, prec=float_precision) if bf else None,
-            "{:.{prec}f}".format(osploc, prec=float_precision) if osploc else None,
-            "{:.{prec}f}".format(sovkc, prec=float_precision) if sovkc else None
-        ])
+def calc_blob_content_data(code, with_loc):
+    loc = count_lines_in(code) if with_loc else None
+    n_all, n_vk = count_identifiers_in(code)
+    return loc, n_all, n_vk
+
+
+def calc_content_metrics(filename, mapping, content_data):
+    loc, n_all, n_vk = content_data
+
+    # metric 4: OSpLoC
+    osploc = None
+    if filename in mapping and loc:
+        object_name = mapping[filename]
+        object_size = os.path.getsize(object_name)
+        osploc = object_size / loc
+
+    # metric 5: SoVkC
+    if n_all and n_vk:
+        sovkc = n_vk / n_all
+    else:
+        sovkc = None
+
+    return osploc, sovkc
+
+
+# compile mapping and blob reader of a worker process, set once by the pool
+# initializer
+worker_mapping = {}
+worker_blob_reader = None
+
+
+def init_worker(mapping, read_blobs):
+    global worker_mapping, worker_blob_reader
+    worker_mapping = mapping
+    if read_blobs:
+        worker_blob_reader = GitBlobReader()
+
+
+def analyse_file(filename):
+    return calc_content_data(filename, filename in worker_mapping)
+
+
+def analyse_blob(blob):
+    return calc_blob_content_data(worker_blob_reader.read(blob), False)
+
+
+def format_row(f, mtbc, noc, bf, osploc, sovkc):
+    return [
+        f,
+        "{:d}".format(int(mtbc)) if mtbc else None,
+        "{:d}".format(int(noc)) if noc else None,
+        "{:.{prec}f}".format(bf, prec=float_precision) if bf else None,
+        "{:.{prec}f}".format(osploc, prec=float_precision) if osploc else None,
+        "{:.{prec}f}".format(sovkc, prec=float_precision) if sovkc else None
+    ]
+
+
+def main(single_pass, jobs, incremental, state_file,
+        content_cache_file, content_cache_size, rev, follow_renames,
+        vectorized):
+    blob_ids = {}
+    if rev:
+        # read the files of the revision from the object database, the object
+        # files of the build do not belong to it, so OSpLoC is skipped
+        filenames, blob_ids = list_source_code_files(rev)
+        mapping = {}
+    else:
+        # find all files in repo
+        filenames = find_source_code_files()
+        # load compile mapping (returns the last found object name for each input file)
+        mapping = load_mapping_from_compile_command_db()
+
+    since = last_year_since(rev or "HEAD")
+    state = load_state(state_file) if incremental else None
+    if incremental:
+        head = run_command("git rev-parse HEAD", multiline_output=False)
+        signatures = {f: file_signature(f) for f in filenames}
+
+    revision_index = None
+    if state:
+        revision_index = update_revision_index(
+            state, head, since, follow_renames
+        )
+    if revision_index is None and (
+            single_pass or incremental or follow_renames or vectorized):
+        # walk the history once instead of running `git log` per file
+        revision_index = load_revision_index(
+            since, rev or "HEAD", {} if follow_renames else None
+        )
+
+    # only analyse the contents of new and changed files in incremental mode
+    known_content_data = {}
+    if state:
+        known_content_data = reusable_content_data(
+            state, head, signatures, mapping
+        )
+    changed_filenames = [f for f in filenames if f not in known_content_data]
+
+    # look up the remaining files by their blob id in the content cache
+    content_cache = None
+    if content_cache_file:
+        if not rev:
+            blob_ids = load_blob_ids()
+        content_cache = ContentCache(content_cache_file, content_cache_size)
+        cached_content_data = content_cache.lookup(set(
+            blob_ids[f] for f in changed_filenames if f in blob_ids
+        ))
+        for f in changed_filenames:
+            content_data = cached_content_data.get(blob_ids.get(f))
+            if content_data and (content_data[0] is not None or f not in mapping):
+                known_content_data[f] = content_data
+        changed_filenames = [
+            f for f in filenames if f not in known_content_data
+        ]
 
     writer = csv.writer(sys.stdout, delimiter=';')
     writer.writerow(["filename", "MTBC", "NoC", "BF", "OSpLoC", "SoVkC"])
-    writer.writerows(metrics)
+
+    pool = None
+    blob_reader = None
+    if jobs > 1:
+        # fan the file analysis out, `imap` returns the results in order
+        pool = Pool(jobs, initializer=init_worker, initargs=(mapping, rev))
+        chunksize = max(1, min(64, len(changed_filenames) // (jobs * 4)))
+        if rev:
+            computed_content_data = pool.imap(
+                analyse_blob, [blob_ids[f] for f in changed_filenames], chunksize
+            )
+        else:
+            computed_content_data = pool.imap(
+                analyse_file, changed_filenames, chunksize
+            )
+    elif rev:
+        blob_reader = GitBlobReader()
+        computed_content_data = (
+            calc_blob_content_data(blob_reader.read(blob_ids[f]), False)
+            for f in changed_filenames
+        )
+    else:
+        computed_content_data = (
+            calc_content_data(f, f in mapping) for f in changed_filenames
+        )
+
+    if vectorized:
+        history_metrics = calc_history_metrics_vectorized(
+            revision_index, filenames
+        )
+
+    content_data_per_file = {}
+    for i, f in enumerate(filenames):
+        if f in known_content_data:
+            content_data = known_content_data[f]
+        else:
+            content_data = next(computed_content_data)
+            if content_cache and f in blob_ids:
+                content_cache.store(blob_ids[f], content_data)
+        content_data_per_file[f] = content_data
+        osploc, sovkc = calc_content_metrics(f, mapping, content_data)
+
+        # metrics 1-3: MTBC, NoC and BF
+        if vectorized:
+            mtbc, noc, bf = history_metrics[i]
+        else:
+            if revision_index is not None:
+                revisions = revision_index.get(f, [])
+            else:
+                revisions = get_last_year_revisions(f, since, rev or "HEAD")
+            mtbc, noc, bf = calc_history_metrics(revisions)
+
+        writer.writerow(format_row(f, mtbc, noc, bf, osploc, sovkc))
+
+    if pool:
+        pool.close()
+        pool.join()
+    if blob_reader:
+        blob_reader.close()
+    if content_cache:
+        content_cache.close()
+
+    if incremental:
+        save_state(state_file, {
+            "cwd": os.getcwd(),
+            "head": head,
+            "since": since,
+            "follow_renames": follow_renames,
+            "revisions": revision_index,
+            "files": {
+                f: [signatures[f], content_data_per_file[f]]
+                for f in filenames
+            }
+        })
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--single-pass', '-s',
+        help='walk the git history once and build a revision index '
+            +'instead of running `git log` for every file',
+        action='store_true',
+        dest='single_pass'
+    )
+    parser.add_argument('--jobs', '-j',
+        type=int,
+        help='number of worker processes used to analyse the file contents',
+        default=1
+    )
+    parser.add_argument('--incremental', '-i',
+        help='reuse the results of the last run stored in the state file and '
+            +'only analyse the files and commits that changed since then',
+        action='store_true',
+        dest='incremental'
+    )
+    parser.add_argument('--state-file',
+        type=str,
+        help='state file of the incremental mode (default: {} in the git '
+            +'dir, named after the current directory)'.format(
+            state_filename.format("<hash>")
+        ),
+        dest='state_file'
+    )
+
+    parser.add_argument('--content-cache', '-c',
+        help='cache the content metrics per git blob id, so they are only '
+            +'computed once for every unique file content',
+        action='store_true',
+        dest='content_cache'
+    )
+    parser.add_argument('--cache-file',
+        type=str,
+        help='content cache file (default: {} in the git dir)'.format(
+            content_cache_filename
+        ),
+        dest='cache_file'
+    )
+    parser.add_argument('--cache-size',
+        type=int,
+        help='maximum number of cached blobs, the least recently used ones '
+            +'are evicted (default: {})'.format(default_content_cache_size),
+        default=default_content_cache_size,
+        dest='cache_size'
+    )
+
+    parser.add_argument('--rev', '-r',
+        type=str,
+        help='analyse the files of a revision read from the object database '
+            +'instead of the working tree, OSpLoC is not computed'
+    )
+
+    parser.add_argument('--follow-renames', '-m',
+        help='track the history of files across renames detected by '
+            +'`git log -M`, implies --single-pass',
+        action='store_true',
+        dest='follow_renames'
+    )
+
+    parser.add_argument('--vectorized', '-v',
+        help='compute MTBC, NoC and BF for all files at once with numpy, '
+            +'implies --single-pass',
+        action='store_true',
+        dest='vectorized'
+    )
+
+    args = parser.parse_args()
+    if args.rev and args.incremental:
+        parser.error("--incremental can not be combined with --rev")
+    state_file = None
+    if args.incremental:
+        state_file = args.state_file or default_state_file()
+    content_cache_file = None
+    if args.content_cache:
+        content_cache_file = args.cache_file or default_content_cache_file()
+    main(args.single_pass, args.jobs, args.incremental, state_file,
+        content_cache_file, args.cache_size, args.rev, args.follow_renames,
+        args.vectorized)
@@ -4,10 +4,16 @@ import subprocess
 import math
 import sys
 import re
-from datetime import timedelta
+import csv
+import heapq
+import struct
+import zipfile
+from collections import Counter, defaultdict, deque
+from multiprocessing import Pool
 from datetime import date
 
 try:
+    import numpy as np
     import matplotlib.pyplot as plt
     from matplotlib.colors import Normalize, LogNorm
 except ImportError:
@@ -18,25 +24,40 @@ except ImportError:
 
 deltaDays = 3
 sourcecode_pattern = r'.*\.ts$|.*\.tsx$|.*\.js$|.*\.jsx$'
+# level of detail of the plot, bigger matrices are downsampled and their
+# rows are not labeled anymore
+max_plot_cells = 500
+max_plot_labels = 150
 
 
 class Commit:
-    def __init__(self, hash, author, timestamp, files):
+    def __init__(self, hash, author, timestamp, files, unix_timestamp):
         self.hash = hash
         self.author = author
         self.timestamp = timestamp
         self.filenames = files
+        self.unix_timestamp = unix_timestamp
 
 
-def run_command(command, multiline_output=True, separator="\n"):
+def stream_command(command, separator):
+    # yields the output of the command split at the separator, record by
+    # record while the command is still running instead of buffering the whole
+    # output; a record starts at a line beginning with the separator
     command = command if isinstance(command, list) else command.split()
     process = subprocess.Popen(
         command,
         stdout=subprocess.PIPE
     )
-    output, _ = process.communicate()
-    text = output.decode()
-    return text.split(separator) if multiline_output else text.strip()
+    record = []
+    for line in process.stdout:
+        line = line.decode()
+        if line.startswith(separator):
+            yield "".join(record)
+            record = [line[len(separator):]]
+        else:
+            record.append(line)
+    yield "".join(record)
+    process.wait()
 
 
 def load_all_commits(filter_files):
@@ -47,19 +68,17 @@ def load_all_commits(filter_files):
         "--pretty=format:" + commit_sep + "%H" + value_sep + "%ae" + value_sep + "%at",
         "--no-merges"
     ]
-    result = run_command(command, multiline_output=True, separator=commit_sep)
+    result = stream_command(command, commit_sep)
 
     commits = []
-    commits_per_hash = {}
-    commits_per_day = {}
     files = set()
-    i = 0
     for commit in result:
         if not commit:
             continue
         lines = commit.split("\n")
-        hexhash, author, timestamp = lines[0].split(value_sep)
-        timestamp = date.fromtimestamp(int(timestamp))
+        hexhash, author, unix_timestamp = lines[0].split(value_sep)
+        unix_timestamp = int(unix_timestamp)
+        timestamp = date.fromtimestamp(unix_timestamp)
         filenames = [lines[j] for j in range(1, len(lines)) if lines[j]]
         if filter_files:
             filenames = list(filter(
@@ -70,63 +89,285 @@ def load_all_commits(filter_files):
             hexhash,
             author,
             timestamp,
-            filenames
+            filenames,
+            unix_timestamp
         ))
         files.update(filenames)
+    return commits, sorted(list(files))
 
-        # update indices
-        commits_per_hash[hexhash] = i
-        if timestamp not in commits_per_day:
-            commits_per_day[timestamp] = []
-        commits_per_day[timestamp].append(i)
 
-        i += 1
-    return commits, sorted(list(files)), commits_per_day, commits_per_hash
+def group_by_author(commits):
+    commits_per_author = defaultdict(list)
+    for commit in commits:
+        commits_per_author[commit.author].append(commit)
+    return commits_per_author
 
 
-def init_cooccurrence_matrix(files, value=0):
-    matrix = {}
-    for f1 in files:
-        matrix[f1] = {}
-        for f2 in files:
-            matrix[f1][f2] = value
-    return matrix
+def count_cochanges(commits, matrix, window_seconds=None):
+    # time window of a commit: [-deltaDays; +deltaDays] calendar days or
+    # [-window_seconds; +window_seconds] seconds around it
+    if window_seconds is None:
+        radius = deltaDays
+        key = lambda c: c.timestamp.toordinal()
+    else:
+        radius = window_seconds
+        key = lambda c: c.unix_timestamp
+
+    for author_commits in group_by_author(commits).values():
+        author_commits.sort(key=key)
+        keys = [key(c) for c in author_commits]
+
+        # sliding window over the commits of the author, with running counts
+        # of the files changed by the commits inside the window
+        window = Counter()
+        start = 0
+        end = 0
+        for i, current in enumerate(author_commits):
+            while end < len(author_commits) and keys[end] <= keys[i] + radius:
+                window.update(author_commits[end].filenames)
+                end += 1
+            while keys[start] < keys[i] - radius:
+                for filename in author_commits[start].filenames:
+                    window[filename] -= 1
+                    if not window[filename]:
+                        del window[filename]
+                start += 1
+
+            # the window includes the current commit, like the files of the
+            # other commits plus the own files
+            for file1 in current.filenames:
+                row = matrix[file1]
+                row.update(window)
+                # a file is not coupled to itself
+                del row[file1]
+
+
+def update_pair_counts(matrix, commit, neighbours, sign):
+    # adds (sign=1) or removes (sign=-1) the conjunct changes of a commit with
+    # itself and with the given commits of its time window, in both directions
+    pairs = [(commit.filenames, commit.filenames)]
+    for other in neighbours:
+        pairs.append((commit.filenames, other.filenames))
+        pairs.append((other.filenames, commit.filenames))
+    for filenames1, filenames2 in pairs:
+        for file1 in filenames1:
+            row = matrix[file1]
+            for file2 in filenames2:
+                if file1 != file2:
+                    row[file2] += sign
+                    if not row[file2]:
+                        del row[file2]
+            if not row:
+                del matrix[file1]
+
+
+def write_snapshots(commits, output, period_days, window_days,
+        window_seconds=None):
+    # one snapshot of the counts at the end of every period, covering the
+    # commits of the last window_days days; the counts are updated with the
+    # commits that enter and leave the analysis window instead of recounting
+    if window_seconds is None:
+        radius = deltaDays
+        key = lambda c: c.timestamp.toordinal()
+    else:
+        radius = window_seconds
+        key = lambda c: c.unix_timestamp
+
+    commits = sorted(commits, key=lambda c: c.unix_timestamp)
+    days = [c.timestamp.toordinal() for c in commits]
+    matrix = init_cooccurrence_matrix()
+    # commits inside the analysis window per author, oldest first
+    active = defaultdict(deque)
+    entered = 0
+    left = 0
+
+    with open(output, "w", newline="") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(["period", "file1", "file2", "conjunct_changes"])
+        period_start = days[0] if days else 0
+        while entered < len(commits):
+            period_end = period_start + period_days
+            while entered < len(commits) and days[entered] < period_end:
+                commit = commits[entered]
+                author_commits = active[commit.author]
+                neighbours = []
+                for other in reversed(author_commits):
+                    if key(other) < key(commit) - radius:
+                        break
+                    neighbours.append(other)
+                update_pair_counts(matrix, commit, neighbours, 1)
+                author_commits.append(commit)
+                entered += 1
+
+            while left < entered and days[left] < period_end - window_days:
+                commit = commits[left]
+                author_commits = active[commit.author]
+                author_commits.popleft()
+                neighbours = []
+                for other in author_commits:
+                    if key(other) > key(commit) + radius:
+                        break
+                    neighbours.append(other)
+                update_pair_counts(matrix, commit, neighbours, -1)
+                left += 1
+
+            period = date.fromordinal(period_start).isoformat()
+            for name1 in sorted(matrix):
+                for name2, value in sorted(matrix[name1].items()):
+                    writer.writerow([period, name1, name2, value])
+            period_start = period_end
+
+
+def init_cooccurrence_matrix():
+    # sparse matrix, only pairs of files that changed together are stored
+    return defaultdict(Counter)
+
+
+def export(c, output):
+    with open(output, "w", newline="") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(["file1", "file2", "conjunct_changes"])
+        for name1 in sorted(c):
+            for name2, value in sorted(c[name1].items()):
+                writer.writerow([name1, name2, value])
+
+
+def save_index(c, files, output):
+    # CSR matrix over the sorted files, stored uncompressed so that the
+    # arrays can be memory-mapped by open_index
+    no_changes = {}
+    indptr = [0]
+    indices = []
+    data = []
+    index = {name: i for i, name in enumerate(files)}
+    for name1 in files:
+        counts = c.get(name1, no_changes)
+        for j in sorted(index[name2] for name2 in counts):
+            indices.append(j)
+            data.append(counts[files[j]])
+        indptr.append(len(indices))
+    # a file object keeps np.savez from appending .npz to the given name
+    with open(output, "wb") as f:
+        np.savez(f,
+            indptr=np.array(indptr, dtype=np.int64),
+            indices=np.array(indices, dtype=np.int64),
+            data=np.array(data),
+            files=np.array(files, dtype=str)
+        )
+
+
+def open_index(filename):
+    # np.load cannot memory-map the members of an .npz archive, but as they
+    # are stored uncompressed each one is a plain .npy file inside the zip
+    arrays = {}
+    with zipfile.ZipFile(filename) as archive, open(filename, "rb") as f:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                print("ERROR - the index", filename, "is compressed")
+                sys.exit(1)
+            f.seek(info.header_offset)
+            name_length, extra_length = struct.unpack("<26xHH", f.read(30))
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                header = np.lib.format.read_array_header_1_0(f)
+            else:
+                header = np.lib.format.read_array_header_2_0(f)
+            shape, fortran_order, dtype = header
+            if math.prod(shape) == 0:
+                array = np.empty(shape, dtype=dtype)
+            else:
+                array = np.memmap(filename, dtype=dtype, mode="r",
+                    offset=f.tell(), shape=shape,
+                    order="F" if fortran_order else "C"
+                )
+            arrays[info.filename[:-len(".npy")]] = array
+    return arrays
+
+
+def query_index(index_file, name, top):
+    index = open_index(index_file)
+    files = index["files"]
+    i = np.searchsorted(files, name)
+    if i == len(files) or files[i] != name:
+        print("ERROR - the file", name, "is not part of the index", index_file)
+        sys.exit(1)
+
+    start, end = index["indptr"][i], index["indptr"][i + 1]
+    counts = index["data"][start:end]
+    partners = index["indices"][start:end]
+    # most conjunct changes first, ties in file order
+    order = np.argsort(-counts, kind="stable")[:top]
+    writer = csv.writer(sys.stdout, delimiter=";", lineterminator="\n")
+    writer.writerow(["file", "conjunct_changes"])
+    for k in order:
+        writer.writerow([files[partners[k]], counts[k]])
 
 
-def plot(c, clip):
+def group_by_directory(c, files, depth):
+    # aggregates the counts by the directory prefix of the given depth,
+    # conjunct changes within one directory end up on the diagonal
+    def prefix(name):
+        return "/".join(name.split("/")[:-1][:depth]) or "."
+
+    grouped = init_cooccurrence_matrix()
+    for name1, counts in c.items():
+        row = grouped[prefix(name1)]
+        for name2, value in counts.items():
+            row[prefix(name2)] += value
+    return grouped, sorted(set(prefix(name) for name in files))
+
+
+def top_coupled_files(c, files, k):
+    no_changes = {}
+    totals = {name: sum(c.get(name, no_changes).values()) for name in files}
+    return sorted(heapq.nlargest(k, files, key=totals.get))
+
+
+def plot(c, files, clip, max_cells=max_plot_cells):
+    # larger matrices are downsampled to at most max_cells x max_cells by
+    # taking the maximum of square blocks of files
+    block = max(1, math.ceil(len(files) / max_cells))
+    size = math.ceil(len(files) / block)
+    index = {name: i // block for i, name in enumerate(files)}
+    rows, columns, values = [], [], []
+    for name1, counts in c.items():
+        i = index.get(name1)
+        if i is None:
+            continue
+        for name2, value in counts.items():
+            j = index.get(name2)
+            if j is not None:
+                rows.append(i)
+                columns.append(j)
+                values.append(value)
+    data = np.zeros((size, size))
+    np.maximum.at(data, (rows, columns), values)
+
     # clip to max 30 occurrences as highest value (for color mapping)
     if clip:
         v_max = 30
         v_min = 0
-        data = [
-            [c[name1][name2] for name2 in c[name1]]
-            for name1 in c
-        ]
     else:
-        v_max = 0
-        v_min = math.inf
-        data = []
-        for name1 in c:
-            row = []
-            for name2 in c[name1]:
-                value = c[name1][name2]
-                if value > v_max:
-                    v_max = value
-                if value < v_min:
-                    v_min = value
-                row.append(value)
-            data.append(row)
+        v_max = data.max() if size else 0
+        v_min = data.min() if size else 0
 
     norm = Normalize(vmin=v_min, vmax=v_max, clip=clip)
     #norm = LogNorm(vmin=v_min + 1, vmax=v_max, clip=False)
 
     fig = plt.figure()
-    plt.imshow(data, cmap=plt.cm.YlGn, norm=norm)
+    plt.imshow(data, cmap=plt.cm.YlGn, norm=norm,
+        interpolation="nearest" if block > 1 else None, rasterized=True)
 
-    labels = [name for name in c]
-    ticks = range(len(labels))
-    plt.xticks(ticks, labels, ma="center", rotation="vertical")
-    plt.yticks(ticks, labels, ma="center", va="center")
+    # one label per row, a downsampled row is labeled by its first file
+    if size <= max_plot_labels:
+        labels = files[::block]
+        ticks = range(len(labels))
+        plt.xticks(ticks, labels, ma="center", rotation="vertical")
+        plt.yticks(ticks, labels, ma="center", va="center")
+    else:
+        plt.xticks([])
+        plt.yticks([])
 
     cb = plt.colorbar()
     cb.set_label("Number of conjunct changes")
@@ -136,36 +377,161 @@ def plot(c, clip):
     return fig
 
 
-def main(output, clip, filter_files):
-    commits, files, day_index, hash_index = load_all_commits(filter_files)
-    matrix = init_cooccurrence_matrix(files)
-
-    for index, commithash in enumerate(hash_index):
-        current = commits[hash_index[commithash]]
-        current_author = current.author
-        current_timestamp = current.timestamp
-        current_files = current.filenames
-
-        # iterate over time window [-deltaDays; +deltaDays]
-        other_files = []
-        for x in range(- deltaDays, + deltaDays + 1):
-            date = current_timestamp + timedelta(days=x)
-            try:
-                others = day_index[date]
-                for i in others:
-                    other_commit = commits[i]
-                    if other_commit.hash != current.hash and other_commit.author == current_author:
-                        for filename in other_commit.filenames:
-                            other_files.append(filename)
-            except KeyError:
-                pass
-
-        for file1 in current_files:
-            for file2 in other_files + current_files:
-                if file1 != file2:
-                    matrix[file1][file2] += 1
+def count_cochanges_sparse(commits, files, matrix, window_seconds=None,
+        downweight=False):
+    try:
+        from scipy import sparse
+    except ImportError:
+        print("ERROR - the sparse engine requires scipy")
+        print("      - install it using pip via 'pip3 install scipy'")
+        print("      - you can also use your preferred package manager, e.g. 'apt install python3-scipy'")
+        sys.exit(1)
+
+    if window_seconds is None:
+        radius = deltaDays
+        keys = np.array([c.timestamp.toordinal() for c in commits], dtype=np.int64)
+    else:
+        radius = window_seconds
+        keys = np.array([c.unix_timestamp for c in commits], dtype=np.int64)
+    authors = {}
+    author_ids = np.array(
+        [authors.setdefault(c.author, len(authors)) for c in commits],
+        dtype=np.int64
+    )
+
+    # sort the commits by author and time, the window of a commit is then a
+    # contiguous range found by a binary search over an author-major key
+    order = np.lexsort((keys, author_ids))
+    commits = [commits[i] for i in order]
+    n_commits = len(commits)
+    if n_commits:
+        keys = keys[order] - keys.min()
+        composite = author_ids[order] * (int(keys.max()) + 2 * radius + 1) + keys
+    else:
+        composite = keys
+    window_start = np.searchsorted(composite, composite - radius, side="left")
+    window_end = np.searchsorted(composite, composite + radius, side="right")
+
+    # banded same-author time window matrix (commits x commits)
+    window_sizes = window_end - window_start
+    window_rows = np.repeat(np.arange(n_commits), window_sizes)
+    window_cols = np.arange(window_sizes.sum()) \
+        - np.repeat(np.cumsum(window_sizes) - window_sizes, window_sizes) \
+        + np.repeat(window_start, window_sizes)
+    W = sparse.csr_matrix(
+        (np.ones(len(window_rows), dtype=np.int64), (window_rows, window_cols)),
+        shape=(n_commits, n_commits)
+    )
+
+    # incidence matrix (commits x files), large commits are optionally
+    # down-weighted by the number of their files
+    file_index = {name: i for i, name in enumerate(files)}
+    commit_sizes = np.array([len(c.filenames) for c in commits], dtype=np.int64)
+    incidence_rows = np.repeat(np.arange(n_commits), commit_sizes)
+    incidence_cols = np.array(
+        [file_index[f] for c in commits for f in c.filenames],
+        dtype=np.int64
+    )
+    if downweight:
+        values = 1.0 / commit_sizes[incidence_rows]
+    else:
+        values = np.ones(len(incidence_rows), dtype=np.int64)
+    A = sparse.csr_matrix(
+        (values, (incidence_rows, incidence_cols)),
+        shape=(n_commits, len(files))
+    )
+
+    # coupling counts (files x files), a file is not coupled to itself
+    C = (A.T @ (W @ A)).tocoo()
+    off_diagonal = (C.row != C.col) & (C.data != 0)
+    for i, j, value in zip(
+            C.row[off_diagonal].tolist(),
+            C.col[off_diagonal].tolist(),
+            C.data[off_diagonal].tolist()):
+        matrix[files[i]][files[j]] += value
+
+
+def count_with_engine(commits, files, matrix, engine, window_seconds, downweight):
+    if engine == "sparse":
+        count_cochanges_sparse(commits, files, matrix, window_seconds, downweight)
+    else:
+        count_cochanges(commits, matrix, window_seconds)
+
+
+def partition_by_author(commits, n_partitions):
+    # commits are only coupled to commits of the same author, so the authors
+    # are distributed greedily (largest first) to the least loaded partition,
+    # estimating the work of an author by the squared number of changed files
+    def cost(author_commits):
+        return sum(len(c.filenames) for c in author_commits) ** 2
 
-    fig = plot(matrix, clip)
+    partitions = [[] for _ in range(n_partitions)]
+    loads = [(0, i) for i in range(n_partitions)]
+    for author_commits in sorted(
+            group_by_author(commits).values(), key=cost, reverse=True):
+        load, i = heapq.heappop(loads)
+        partitions[i].extend(author_commits)
+        heapq.heappush(loads, (load + cost(author_commits), i))
+    return [partition for partition in partitions if partition]
+
+
+def count_partition(task):
+    commits, engine, window_seconds, downweight = task
+    files = sorted(set(f for c in commits for f in c.filenames))
+    matrix = init_cooccurrence_matrix()
+    count_with_engine(commits, files, matrix, engine, window_seconds, downweight)
+    return matrix
+
+
+def count_cochanges_parallel(commits, matrix, jobs, engine, window_seconds,
+        downweight):
+    tasks = [
+        (partition, engine, window_seconds, downweight)
+        for partition in partition_by_author(commits, jobs)
+    ]
+    with Pool(jobs) as pool:
+        # merge the partial counts as the workers finish
+        for partial in pool.imap_unordered(count_partition, tasks):
+            for name1, row in partial.items():
+                matrix[name1].update(row)
+
+
+def main(output, clip, filter_files, export_output, window_seconds, engine,
+        max_commit_files, downweight, jobs, group_depth, top_k, max_cells,
+        index_output, snapshots_output, snapshot_period, snapshot_window):
+    commits, files = load_all_commits(filter_files)
+    if max_commit_files:
+        commits = [c for c in commits if len(c.filenames) <= max_commit_files]
+
+    if snapshots_output:
+        write_snapshots(commits, snapshots_output, snapshot_period,
+            snapshot_window or snapshot_period, window_seconds)
+        print("Coupling snapshots saved to", snapshots_output)
+        return
+
+    matrix = init_cooccurrence_matrix()
+    if jobs > 1:
+        count_cochanges_parallel(
+            commits, matrix, jobs, engine, window_seconds, downweight
+        )
+    else:
+        count_with_engine(
+            commits, files, matrix, engine, window_seconds, downweight
+        )
+
+    if export_output:
+        export(matrix, export_output)
+        print("Coupling counts saved to", export_output)
+
+    if index_output:
+        save_index(matrix, files, index_output)
+        print("Coupling index saved to", index_output)
+
+    if group_depth is not None:
+        matrix, files = group_by_directory(matrix, files, group_depth)
+    if top_k:
+        files = top_coupled_files(matrix, files, top_k)
+    fig = plot(matrix, files, clip, max_cells)
     fig.savefig(output, bbox_inches="tight")
     print("Figure saved to", output)
 
@@ -191,5 +557,126 @@ if __name__ == "__main__":
         dest='no_filter_files'
     )
 
+    parser.add_argument('--export', '-e',
+        type=str,
+        help='save the non-zero coupling counts as CSV (file1;file2;count)',
+        dest='export'
+    )
+
+    parser.add_argument('--window-seconds', '-w',
+        type=int,
+        help='time window around a commit in seconds, instead of the '
+            +'default of +-{} calendar days'.format(deltaDays),
+        dest='window_seconds'
+    )
+
+    parser.add_argument('--engine',
+        choices=['window', 'sparse'],
+        help='count the conjunct changes with a per-author sliding window '
+            +'(default) or with sparse matrix products (requires scipy)',
+        default='window'
+    )
+
+    parser.add_argument('--max-commit-files',
+        type=int,
+        help='ignore commits that change more than this many files',
+        dest='max_commit_files'
+    )
+
+    parser.add_argument('--downweight',
+        help='weight the files of a commit by 1 / (number of changed files), '
+            +'only supported by the sparse engine',
+        action='store_true',
+        dest='downweight'
+    )
+
+    parser.add_argument('--jobs', '-j',
+        type=int,
+        help='number of worker processes, the commits are partitioned by author',
+        default=1
+    )
+
+    parser.add_argument('--group-depth', '-g',
+        type=int,
+        help='plot the conjunct changes aggregated by the directories up to '
+            +'this depth',
+        dest='group_depth'
+    )
+
+    parser.add_argument('--top-k', '-k',
+        type=int,
+        help='plot only the k files (or directories) with the most conjunct '
+            +'changes',
+        dest='top_k'
+    )
+
+    parser.add_argument('--max-cells',
+        type=int,
+        help='downsample the plotted matrix to at most this many rows and '
+            +'columns (default: {})'.format(max_plot_cells),
+        default=max_plot_cells,
+        dest='max_cells'
+    )
+
+    parser.add_argument('--save-index',
+        type=str,
+        help='save the coupling counts as a sparse matrix (.npz) for --query',
+        dest='save_index'
+    )
+
+    parser.add_argument('--query', '-q',
+        type=str,
+        help='instead of analysing the repository, print the files most often '
+            +'changed together with the given file according to --index',
+        dest='query'
+    )
+
+    parser.add_argument('--index',
+        type=str,
+        help='coupling index saved with --save-index, used by --query',
+        dest='index'
+    )
+
+    parser.add_argument('--top', '-n',
+        type=int,
+        help='number of files printed by --query',
+        default=10,
+        dest='top'
+    )
+
+    parser.add_argument('--snapshots',
+        type=str,
+        help='instead of plotting, write the conjunct changes of a rolling '
+            +'analysis window to this CSV file, one snapshot per period',
+        dest='snapshots'
+    )
+
+    parser.add_argument('--snapshot-period',
+        type=int,
+        help='days between two snapshots, a snapshot is labeled with the '
+            +'first day of its period',
+        default=30,
+        dest='snapshot_period'
+    )
+
+    parser.add_argument('--snapshot-window',
+        type=int,
+        help='days of history covered by a snapshot (default: the period)',
+        dest='snapshot_window'
+    )
+
     args = parser.parse_args()
-    main(args.output, not args.noclip, not args.no_filter_files)
+    if args.query:
+        if not args.index:
+            parser.error("--query requires --index")
+        query_index(args.index, args.query, args.top)
+        sys.exit(0)
+    if args.downweight and args.engine != 'sparse':
+        parser.error("--downweight requires --engine sparse")
+    if args.downweight and args.snapshots:
+        parser.error("--downweight is not supported with --snapshots")
+    main(args.output, not args.noclip, not args.no_filter_files, args.export,
+        args.window_seconds, args.engine, args.max_commit_files, args.downweight,
+        args.jobs, args.group_depth, args.top_k, args.max_cells,
+        args.save_index, args.snapshots, args.snapshot_period,
+        args.snapshot_window)
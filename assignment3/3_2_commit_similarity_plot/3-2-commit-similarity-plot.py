@@ -3,11 +3,16 @@ import argparse
 import subprocess
 import sys
 import re
+import csv
+import zlib
+from collections import deque
+from multiprocessing import Pool
 from operator import itemgetter
 
 try:
     import matplotlib.pyplot as plt
     from matplotlib.colors import Normalize
+    from matplotlib.cm import ScalarMappable
 except ImportError:
     print("ERROR - this script requires matplotlib")
     print("      - install it using pip via 'pip3 install matplotlib'")
@@ -15,8 +20,9 @@ except ImportError:
     sys.exit(1)
 
 try:
-    from sklearn.feature_extraction.text import CountVectorizer
-    from sklearn.decomposition import PCA, TruncatedSVD
+    import numpy as np
+    from sklearn.feature_extraction.text import CountVectorizer, HashingVectorizer
+    from sklearn.decomposition import PCA, TruncatedSVD, IncrementalPCA
 except ImportError:
     print("ERROR - this script requires sklearn")
     print("      - install it using pip via 'pip3 install scikit-learn'")
@@ -25,64 +31,101 @@ except ImportError:
 
 token_pattern = r'\w\w+'
 random_seed = 89715348
+commit_sep = "~~==~~"
+commits_per_chunk = 500
+# number of hashed token features of the streaming mode
+hashing_features = 1024
+# near-duplicate detection: MinHash signatures of the shingles (runs of
+# consecutive changed lines) of a diff, split into bands for the LSH buckets
+minhash_permutations = 64
+lsh_bands = 16
+shingle_lines = 2
+mersenne_prime = (1 << 31) - 1
+git_exclude_prefixes = [
+    "diff",
+    "index", "mode", "new", "old", "deleted", "copy",
+    "rename", "similarity", "dissimilarity",
+    "---", "+++",
+    "@@", "@@@"
+]
+# a changed line stripped of whitespace, unless it is empty or starts with
+# one of the git diff header prefixes; \s matches the same (Unicode)
+# whitespace as str.strip
+changed_line_pattern = re.compile(
+    r'^[^\S\n]*'
+    + r'((?!' + '|'.join(re.escape(p) for p in git_exclude_prefixes) + r')'
+    + r'\S(?:[^\n]*\S)?)'
+    + r'[^\S\n]*$',
+    re.MULTILINE
+)
 
 
-def run_command(command, multiline_output=True, separator="\n"):
-    command = command if isinstance(command, list) else command.split()
+def read_command(command, input=None):
     process = subprocess.Popen(
         command,
+        stdin=subprocess.PIPE if input is not None else None,
         stdout=subprocess.PIPE
     )
-    output, _ = process.communicate()
-    text = output.decode()
-    return text.split(separator) if multiline_output else text.strip()
+    output, _ = process.communicate(input)
+    return output
 
 
-def startswith_none_of(exclude_patterns, text):
-    return not any(
-        text.strip().startswith(pattern) for pattern in exclude_patterns
+def load_chunk(hashes):
+    # diffs of the given commits in the given order, reduced to the changed
+    # lines that are not part of the git diff headers
+    output = read_command(
+        [
+            "git", "log", "--no-walk=unsorted", "--stdin", "--no-color",
+            "--cc", "-U0", "--pretty=format:" + commit_sep + "%H %ae"
+        ],
+        input="\n".join(hashes).encode()
     )
-
-
-def load():
-    commit_sep = "~~==~~"
-    command = [
-        "git", "log", "--no-merges", "--no-color", "--cc", "-U0",
-        "--pretty=format:" + commit_sep + "%ae"
-    ]
-    result = run_command(command, multiline_output=True, separator=commit_sep)
-
-    git_exclude_prefixes = [
-        "diff",
-        "index", "mode", "new", "old", "deleted", "copy",
-        "rename", "similarity", "dissimilarity",
-        "---", "+++",
-        "@@", "@@@"
-    ]
-
     commits = []
-    for commit in result:
+    for commit in output.split(commit_sep.encode()):
         if not commit:
             continue
-        lines = commit.split("\n")
-        author = lines[0]
-        lines = filter(
-            lambda x: x and startswith_none_of(git_exclude_prefixes, x),
-            map(
-                lambda x: x.strip(),
-                lines[1:]
-            )
-        )
-        commits.append((author, "\n".join(lines)))
+        header, _, diff = commit.partition(b"\n")
+        hexhash, _, author = header.decode().partition(" ")
+        lines = changed_line_pattern.findall(diff.decode(errors="replace"))
+        commits.append((hexhash, author, "\n".join(lines)))
     return commits
 
 
+def iter_commits(jobs):
+    # the history is split into chunks of commits whose diffs are generated
+    # and filtered by worker processes, the results are yielded in the order
+    # of `git log`; at most 2 chunks per worker are in flight, so the memory
+    # stays bounded when the consumer is slower than the workers
+    hashes = read_command(["git", "rev-list", "--no-merges", "HEAD"]).split()
+    chunks = [
+        [h.decode() for h in hashes[i:i + commits_per_chunk]]
+        for i in range(0, len(hashes), commits_per_chunk)
+    ]
+    if jobs > 1:
+        with Pool(jobs) as pool:
+            pending = deque()
+            for chunk in chunks:
+                if len(pending) == 2 * jobs:
+                    yield from pending.popleft().get()
+                pending.append(pool.apply_async(load_chunk, (chunk,)))
+            while pending:
+                yield from pending.popleft().get()
+    else:
+        for chunk in chunks:
+            yield from load_chunk(chunk)
+
+
+def load(jobs=1):
+    return list(iter_commits(jobs))
+
+
 def plot_scatter(points, authors):
     x = list(map(itemgetter(0), points))
     y = list(map(itemgetter(1), points))
 
     color_mapping = sorted(set(authors), reverse=True)
-    c = [float(color_mapping.index(author)) for author in authors]
+    color_index = {author: i for i, author in enumerate(color_mapping)}
+    c = [float(color_index[author]) for author in authors]
     norm = Normalize(vmin=0, vmax=len(color_mapping)-1, clip=False)
 
     fig = plt.figure()
@@ -105,26 +148,183 @@ def plot_scatter(points, authors):
     return fig
 
 
-def main(output, sparse):
-    commits = load()
-    corpus = (text for _, text in commits)
-    authors = [author for author, _ in commits]
-    cv = CountVectorizer(
+def plot_density(points, authors, bins):
+    # the points are binned into a bins x bins image instead of drawing one
+    # marker per commit: the color of a pixel mixes the author colors of its
+    # commits, and its opacity grows with the (log) number of commits
+    points = np.asarray(points)
+    color_mapping = sorted(set(authors), reverse=True)
+    color_index = {author: i for i, author in enumerate(color_mapping)}
+    norm = Normalize(vmin=0, vmax=len(color_mapping)-1, clip=False)
+    colors = plt.cm.Set1(norm([color_index[author] for author in authors]))
+
+    lower = points.min(axis=0)
+    extent = points.max(axis=0) - lower
+    extent[extent == 0] = 1
+    cells = ((points - lower) / extent * bins).astype(int).clip(0, bins - 1)
+    pixel = cells[:, 1] * bins + cells[:, 0]
+
+    counts = np.bincount(pixel, minlength=bins * bins)
+    image = np.zeros((bins * bins, 4))
+    for channel in range(3):
+        image[:, channel] = np.bincount(
+            pixel, weights=colors[:, channel], minlength=bins * bins
+        )
+    filled = counts > 0
+    image[filled, :3] /= counts[filled, None]
+    image[:, 3] = np.log1p(counts) / np.log1p(counts.max())
+
+    fig = plt.figure()
+    plt.imshow(
+        image.reshape(bins, bins, 4),
+        origin="lower",
+        extent=(lower[0], lower[0] + extent[0], lower[1], lower[1] + extent[1]),
+        aspect="auto",
+        interpolation="nearest"
+    )
+
+    cb = plt.colorbar(ScalarMappable(norm=norm, cmap=plt.cm.Set1), ax=plt.gca())
+    cb.set_label("authors")
+    cb.set_ticks(range(len(color_mapping)))
+    cb.set_ticklabels(color_mapping)
+    plt.close()
+    return fig
+
+
+def iter_batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def embed_streaming(jobs, batch_size):
+    # the hashing vectorizer needs no vocabulary, so the diffs are read batch
+    # by batch twice: to fit the PCA and to project the commits afterwards
+    hv = HashingVectorizer(
         analyzer="word",
         token_pattern=token_pattern,
-        max_features=256
+        n_features=hashing_features,
+        alternate_sign=False,
+        norm=None
     )
-    X = cv.fit_transform(corpus)
+    pca = IncrementalPCA(n_components=2)
+    for batch in iter_batches(iter_commits(jobs), batch_size):
+        # a batch needs at least as many commits as components, which only
+        # a short last batch can lack
+        if len(batch) >= pca.n_components:
+            pca.partial_fit(hv.transform(text for _, _, text in batch).toarray())
+
+    authors = []
+    Y = []
+    for batch in iter_batches(iter_commits(jobs), batch_size):
+        authors.extend(author for _, author, _ in batch)
+        Y.extend(pca.transform(hv.transform(text for _, _, text in batch).toarray()))
+    return Y, authors
+
+
+def minhash_signature(text, a, b):
+    lines = text.split("\n")
+    shingles = set(
+        "\n".join(lines[i:i + shingle_lines])
+        for i in range(max(len(lines) - shingle_lines + 1, 1))
+    )
+    values = np.array(
+        [zlib.crc32(shingle.encode()) for shingle in shingles],
+        dtype=np.int64
+    ) % mersenne_prime
+    # minimum of the hash functions (a * x + b) mod p over all shingles,
+    # computed in blocks to bound the memory for huge diffs
+    signature = np.full(len(a), mersenne_prime, dtype=np.int64)
+    for i in range(0, len(values), 4096):
+        hashes = (np.outer(a, values[i:i + 4096]) + b[:, None]) % mersenne_prime
+        np.minimum(signature, hashes.min(axis=1), out=signature)
+    return signature
+
+
+def write_duplicates(output, jobs, min_similarity):
+    # streaming leader clustering: a commit joins the most similar leader
+    # found in its LSH buckets, or becomes a new leader itself; only the
+    # signatures of the leaders are kept in memory
+    rnd = np.random.RandomState(random_seed)
+    a = rnd.randint(1, mersenne_prime, size=minhash_permutations, dtype=np.int64)
+    b = rnd.randint(0, mersenne_prime, size=minhash_permutations, dtype=np.int64)
+    rows = minhash_permutations // lsh_bands
 
-    if sparse:
-        # PCA does not support sparse input, so use the alternative:
-        svd = TruncatedSVD(n_components=2, random_state=random_seed, n_iter=10)
-        Y = svd.fit_transform(X)
+    buckets = {}
+    leaders = []
+    signatures = []
+    listed = set()
+    with open(output, "w", newline="") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(["cluster", "commit", "author", "similarity"])
+        for hexhash, author, text in iter_commits(jobs):
+            if not text:
+                continue
+            signature = minhash_signature(text, a, b)
+            keys = [
+                (band, signature[band * rows:(band + 1) * rows].tobytes())
+                for band in range(lsh_bands)
+            ]
+            candidates = set()
+            for key in keys:
+                candidates.update(buckets.get(key, ()))
+
+            # the estimated Jaccard similarity is the share of equal minima
+            best = None
+            best_similarity = min_similarity
+            for leader in sorted(candidates):
+                similarity = np.mean(signatures[leader] == signature)
+                if similarity >= best_similarity and (
+                        best is None or similarity > best_similarity):
+                    best = leader
+                    best_similarity = similarity
+
+            if best is None:
+                for key in keys:
+                    buckets.setdefault(key, []).append(len(leaders))
+                leaders.append((hexhash, author))
+                signatures.append(signature)
+                continue
+            leader_hash, leader_author = leaders[best]
+            if best not in listed:
+                writer.writerow([leader_hash, leader_hash, leader_author, "1.000"])
+                listed.add(best)
+            writer.writerow([
+                leader_hash, hexhash, author, "{:.3f}".format(best_similarity)
+            ])
+
+
+def main(output, sparse, jobs, streaming, batch_size, density):
+    if streaming:
+        Y, authors = embed_streaming(jobs, batch_size)
     else:
-        pca = PCA(n_components=2, random_state=random_seed)
-        Y = pca.fit_transform(X.toarray())
+        commits = load(jobs)
+        corpus = (text for _, _, text in commits)
+        authors = [author for _, author, _ in commits]
+        cv = CountVectorizer(
+            analyzer="word",
+            token_pattern=token_pattern,
+            max_features=256
+        )
+        X = cv.fit_transform(corpus)
+
+        if sparse:
+            # PCA does not support sparse input, so use the alternative:
+            svd = TruncatedSVD(n_components=2, random_state=random_seed, n_iter=10)
+            Y = svd.fit_transform(X)
+        else:
+            pca = PCA(n_components=2, random_state=random_seed)
+            Y = pca.fit_transform(X.toarray())
 
-    fig = plot_scatter(Y, authors)
+    if density:
+        fig = plot_density(Y, authors, density)
+    else:
+        fig = plot_scatter(Y, authors)
     fig.savefig(output, bbox_inches="tight")
     print("Figure saved to", output)
 
@@ -144,5 +344,57 @@ if __name__ == "__main__":
         dest='sparse'
     )
 
+    parser.add_argument('--jobs', '-j',
+        type=int,
+        help='number of worker processes used to generate and filter the diffs',
+        default=1
+    )
+
+    parser.add_argument('--streaming',
+        help='vectorize the diffs batch by batch with a HashingVectorizer and '
+            +'use IncrementalPCA, which keeps the memory usage bounded',
+        action='store_true',
+        dest='streaming'
+    )
+
+    parser.add_argument('--batch-size',
+        type=int,
+        help='number of commits per batch of the streaming mode',
+        default=10000,
+        dest='batch_size'
+    )
+
+    parser.add_argument('--duplicates',
+        type=str,
+        help='instead of plotting, write clusters of near-duplicate commits '
+            +'(e.g. cherry-picks) found by MinHash/LSH to this CSV file',
+        dest='duplicates'
+    )
+
+    parser.add_argument('--min-similarity',
+        type=float,
+        help='minimum estimated Jaccard similarity of the diff shingles of '
+            +'near-duplicate commits',
+        default=0.8,
+        dest='min_similarity'
+    )
+
+    parser.add_argument('--density',
+        type=int,
+        help='draw the commits binned into a BINS x BINS image instead of one '
+            +'marker per commit, for large histories',
+        metavar='BINS',
+        dest='density'
+    )
+
     args = parser.parse_args()
-    main(args.output, args.sparse)
+    if args.duplicates:
+        write_duplicates(args.duplicates, args.jobs, args.min_similarity)
+        print("Near-duplicate commits saved to", args.duplicates)
+        sys.exit(0)
+    if args.streaming and args.sparse:
+        parser.error("--sparse is not supported with --streaming")
+    if args.batch_size < 2:
+        parser.error("--batch-size has to be at least 2")
+    main(args.output, args.sparse, args.jobs, args.streaming, args.batch_size,
+        args.density)
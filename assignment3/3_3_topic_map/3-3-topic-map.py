@@ -2,7 +2,12 @@
 import argparse
 import subprocess
 import sys
+import os
 import re
+import json
+import sqlite3
+from collections import Counter
+from multiprocessing import Pool
 from operator import itemgetter
 
 try:
@@ -14,8 +19,11 @@ except ImportError:
     sys.exit(1)
 
 try:
-    from sklearn.feature_extraction.text import CountVectorizer
+    import numpy as np
+    from scipy import sparse
     from sklearn.manifold import MDS
+    from sklearn.decomposition import TruncatedSVD
+    from sklearn.metrics.pairwise import euclidean_distances
 except ImportError:
     print("ERROR - this script requires sklearn")
     print("      - install it using pip via 'pip3 install scikit-learn'")
@@ -24,7 +32,14 @@ except ImportError:
 
 sourcecode_pattern = r'.*\.ts$|.*\.tsx$|.*\.js$|.*\.jsx$'
 token_pattern = r'\w\w+'
+token_regex = re.compile(token_pattern)
+max_features = 256
 random_seed = 89715348
+# cache of the term counts per git blob id, stored in the git dir by default
+term_cache_filename = "topic-map-cache.sqlite"
+# landmark MDS: number of landmark files and of files positioned at once
+n_landmarks = 500
+embedding_batch_size = 10000
 
 
 def run_command(command, multiline_output=True, separator="\n"):
@@ -38,22 +53,259 @@ def run_command(command, multiline_output=True, separator="\n"):
     return text.split(separator) if multiline_output else text.strip()
 
 
+class GitBlobReader:
+    # reads blobs from the object database through one long-lived
+    # `git cat-file --batch` process
+    def __init__(self):
+        self.process = subprocess.Popen(
+            ['git', 'cat-file', '--batch'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE
+        )
+
+    def read(self, object_id):
+        self.process.stdin.write(object_id.encode() + b"\n")
+        self.process.stdin.flush()
+        header = self.process.stdout.readline().split()
+        if header[-1] == b"missing":
+            raise KeyError(object_id)
+        data = self.process.stdout.read(int(header[2]))
+        # skip the LF terminating the object content
+        self.process.stdout.read(1)
+        return data
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+
+class TermCountCache:
+    # persistent cache of the term counts of a file content keyed by blob id
+    def __init__(self, filename):
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS terms ("
+            + "blob TEXT PRIMARY KEY, counts TEXT NOT NULL)"
+        )
+
+    def lookup(self, blobs, batch_size=500):
+        blobs = list(blobs)
+        result = {}
+        for i in range(0, len(blobs), batch_size):
+            batch = blobs[i:i + batch_size]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.connection.execute(
+                "SELECT blob, counts FROM terms "
+                + "WHERE blob IN (" + placeholders + ")",
+                batch
+            )
+            for blob, counts in rows:
+                result[blob] = Counter(json.loads(counts))
+        return result
+
+    def store(self, blob, counts):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO terms VALUES (?, ?)",
+            (blob, json.dumps(counts))
+        )
+
+    def prune(self):
+        # evicts the blobs that are not reachable from any ref, reflog entry
+        # or the index anymore, so staged files keep their cached counts
+        self.connection.execute("CREATE TEMP TABLE reachable (blob TEXT PRIMARY KEY)")
+        process = subprocess.Popen(
+            ['git', 'rev-list', '--objects', '--all', '--indexed-objects',
+                '--reflog'],
+            stdout=subprocess.PIPE
+        )
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO reachable VALUES (?)",
+            ((line.split(maxsplit=1)[0].decode(),) for line in process.stdout)
+        )
+        process.wait()
+        removed = self.connection.execute(
+            "DELETE FROM terms WHERE blob NOT IN (SELECT blob FROM reachable)"
+        ).rowcount
+        self.connection.execute("DROP TABLE reachable")
+        return removed
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
 def find_source_code_files():
-    output = run_command('find . -type f')
+    # the tracked files below the current directory, which leaves out .git
+    # and ignored directories like node_modules
+    output = run_command([
+        'git', '-c', 'core.quotePath=false', 'ls-files', '-s'
+    ])
+    files = []
+    for line in output:
+        if not line:
+            continue
+        info, filename = line.split("\t", 1)
+        mode = info.split()[0]
+        # skip submodules, symlinks and files deleted in the working tree
+        if mode in ("160000", "120000") or not os.path.isfile(filename):
+            continue
+        if re.fullmatch(sourcecode_pattern, filename):
+            files.append(filename)
+    # a file with merge conflicts is listed once per stage
+    return sorted(set(files))
+
+
+# lists the source code files of a revision with their blob ids
+def list_source_code_files(rev):
+    output = run_command([
+        'git', '-c', 'core.quotePath=false', 'ls-tree', '-r', rev
+    ])
+    files = []
+    blob_ids = []
+    for line in output:
+        if not line:
+            continue
+        info, filename = line.split("\t", 1)
+        mode, object_type, object_id = info.split()
+        # skip submodules and symlinks, like `find_source_code_files` does
+        if object_type != "blob" or mode == "120000":
+            continue
+        if re.fullmatch(sourcecode_pattern, filename):
+            files.append(filename)
+            blob_ids.append(object_id)
+    return files, blob_ids
+
+
+# blob ids of the tracked files whose working tree content matches the index
+def load_blob_ids():
+    modified = set(run_command([
+        'git', '-c', 'core.quotePath=false', 'ls-files', '-m'
+    ]))
+    blob_ids = {}
+    for line in run_command([
+        'git', '-c', 'core.quotePath=false', 'ls-files', '-s'
+    ]):
+        if not line:
+            continue
+        info, filename = line.split("\t", 1)
+        _, blob, stage = info.split()
+        if stage == "0" and filename not in modified:
+            blob_ids[filename] = blob
+    return blob_ids
+
+
+def default_term_cache_file():
+    git_dir = run_command(
+        "git rev-parse --git-common-dir",
+        multiline_output=False
+    )
+    return os.path.join(git_dir, term_cache_filename)
+
+
+def count_terms(data):
+    # tokenizes like CountVectorizer(token_pattern=token_pattern) does,
+    # invalid UTF-8 is replaced instead of failing
+    return Counter(token_regex.findall(data.decode("utf-8", errors="replace").lower()))
+
+
+# worker state of the file analysis, set by the pool initializer
+worker_blob_reader = None
+
+
+def init_worker(read_blobs):
+    global worker_blob_reader
+    if read_blobs:
+        worker_blob_reader = GitBlobReader()
 
-    # strip first two chars './' added by the find tool
-    sourceFiles = [line[2:] for line in output]
-    return list(filter(lambda f: re.fullmatch(sourcecode_pattern, f), sourceFiles))
 
+def count_file_terms(filename):
+    with open(filename, "rb") as f:
+        return count_terms(f.read())
 
-def load():
-    files = find_source_code_files()
-    documents = []
-    for filename in files:
-        with open(filename, "r", encoding='utf-8') as f:
-            documents.append("\n".join(f))
 
-    return files, documents
+def count_blob_terms(blob):
+    return count_terms(worker_blob_reader.read(blob))
+
+
+# returns the files with the counts of their terms, only the counts are kept
+# in memory instead of the contents
+def load(rev=None, jobs=1, term_cache=None):
+    if rev:
+        # read the files of the revision without touching the working tree
+        files, sources = list_source_code_files(rev)
+        blob_ids = dict(zip(files, sources))
+        count = count_blob_terms
+    else:
+        files = find_source_code_files()
+        sources = files
+        # modified files have no blob id and bypass the cache
+        blob_ids = load_blob_ids() if term_cache else {}
+        count = count_file_terms
+
+    # only the files whose blobs are not cached are tokenized
+    known_counts = {}
+    if term_cache:
+        cached_counts = term_cache.lookup(set(
+            blob_ids[f] for f in files if f in blob_ids
+        ))
+        for f in files:
+            if blob_ids.get(f) in cached_counts:
+                known_counts[f] = cached_counts[blob_ids[f]]
+    changed = [
+        source for f, source in zip(files, sources) if f not in known_counts
+    ]
+
+    if jobs > 1:
+        chunksize = max(1, min(64, len(changed) // (jobs * 4)))
+        with Pool(jobs, initializer=init_worker, initargs=(rev,)) as pool:
+            computed_counts = list(pool.imap(count, changed, chunksize))
+    else:
+        init_worker(rev)
+        computed_counts = [count(source) for source in changed]
+        if worker_blob_reader:
+            worker_blob_reader.close()
+
+    term_counts = []
+    computed_counts = iter(computed_counts)
+    for f in files:
+        if f in known_counts:
+            counts = known_counts[f]
+        else:
+            counts = next(computed_counts)
+            if term_cache and f in blob_ids:
+                term_cache.store(blob_ids[f], counts)
+        term_counts.append(counts)
+    return files, term_counts
+
+
+def vectorize(term_counts):
+    # the same matrix as CountVectorizer(max_features=max_features) builds:
+    # the columns are the most frequent terms of all files (selected like
+    # sklearn does, including ties) in alphabetical order
+    totals = Counter()
+    for counts in term_counts:
+        totals.update(counts)
+    terms = sorted(totals)
+    frequencies = np.array([totals[term] for term in terms], dtype=np.int64)
+    selected = np.sort((-frequencies).argsort()[:max_features])
+    vocabulary = {terms[i]: j for j, i in enumerate(selected)}
+
+    indptr = [0]
+    indices = []
+    data = []
+    for counts in term_counts:
+        for term, count in counts.items():
+            j = vocabulary.get(term)
+            if j is not None:
+                indices.append(j)
+                data.append(count)
+        indptr.append(len(indices))
+    X = sparse.csr_matrix(
+        (np.array(data, dtype=np.int64), indices, indptr),
+        shape=(len(term_counts), len(vocabulary))
+    )
+    X.sort_indices()
+    return X
 
 
 def plot_scatter(points, filenames):
@@ -79,17 +331,62 @@ def plot_scatter(points, filenames):
     return fig
 
 
-def main(output):
-    filenames, documents = load()
-    cv = CountVectorizer(
-        analyzer="word",
-        token_pattern=token_pattern,
-        max_features=256
-    )
-    X = cv.fit_transform(documents)
+def landmark_mds(X):
+    # landmark MDS (de Silva & Tenenbaum): classical MDS of a random sample
+    # of files, the other files are positioned by their distances to these
+    # landmarks, so memory and time are linear in the number of files
+    rnd = np.random.RandomState(random_seed)
+    n = X.shape[0]
+    landmarks = np.sort(rnd.choice(n, size=min(n_landmarks, n), replace=False))
+    L = X[landmarks]
+    D = euclidean_distances(L, squared=True)
+
+    # double centering of the squared distances and its two largest eigenpairs
+    k = D.shape[0]
+    J = np.eye(k) - np.full((k, k), 1 / k)
+    eigenvalues, eigenvectors = np.linalg.eigh(-0.5 * J @ D @ J)
+    top = np.argsort(eigenvalues)[::-1][:2]
+    eigenvalues = eigenvalues[top]
+    eigenvectors = eigenvectors[:, top]
+    # pseudo-inverse of the landmark coordinates, dimensions without a positive
+    # eigenvalue stay at 0
+    scale = np.zeros_like(eigenvalues)
+    positive = eigenvalues > 1e-12
+    scale[positive] = 1 / np.sqrt(eigenvalues[positive])
+    projection = (eigenvectors * scale).T
+    mean_distances = D.mean(axis=0)
+
+    Y = np.zeros((n, 2))
+    for start in range(0, n, embedding_batch_size):
+        batch = X[start:start + embedding_batch_size]
+        distances = euclidean_distances(batch, L, squared=True)
+        Y[start:start + embedding_batch_size] = (
+            -0.5 * (distances - mean_distances) @ projection.T
+        )
+    return Y
+
 
-    mds = MDS(n_components=2, random_state=random_seed, n_jobs=-1)
-    Y = mds.fit_transform(X.toarray())
+def main(output, rev, embedding, jobs, term_cache_file, prune_cache):
+    term_cache = None
+    if term_cache_file:
+        term_cache = TermCountCache(term_cache_file)
+    filenames, term_counts = load(rev, jobs, term_cache)
+    if term_cache:
+        if prune_cache:
+            print("Removed", term_cache.prune(), "unreachable blobs from the cache")
+        term_cache.close()
+    X = vectorize(term_counts)
+
+    if embedding == "landmark":
+        Y = landmark_mds(X)
+    elif embedding == "svd":
+        # works on the sparse matrix, but projects instead of preserving
+        # the distances like MDS does
+        svd = TruncatedSVD(n_components=2, random_state=random_seed)
+        Y = svd.fit_transform(X)
+    else:
+        mds = MDS(n_components=2, random_state=random_seed, n_jobs=-1)
+        Y = mds.fit_transform(X.toarray())
 
     fig = plot_scatter(Y, filenames)
     fig.savefig(output, bbox_inches="tight")
@@ -105,5 +402,49 @@ if __name__ == "__main__":
         default='result.pdf'
     )
 
+    parser.add_argument('--rev', '-r',
+        type=str,
+        help='build the topic map of a revision read from the object database '
+            +'instead of the working tree'
+    )
+
+    parser.add_argument('--embedding', '-e',
+        choices=['mds', 'svd', 'landmark'],
+        help='2D embedding of the files: MDS of the dense matrix (default), '
+            +'TruncatedSVD or landmark MDS of the sparse matrix, the latter '
+            +'two scale to large repositories',
+        default='mds'
+    )
+
+    parser.add_argument('--jobs', '-j',
+        type=int,
+        help='number of worker processes used to read and tokenize the files',
+        default=1
+    )
+
+    parser.add_argument('--term-cache', '-c',
+        help='cache the term counts per git blob id, so only new and changed '
+            +'file contents are tokenized',
+        action='store_true',
+        dest='term_cache'
+    )
+    parser.add_argument('--cache-file',
+        type=str,
+        help='term cache file (default: {} in the git dir)'.format(
+            term_cache_filename
+        ),
+        dest='cache_file'
+    )
+    parser.add_argument('--prune-cache',
+        help='remove the blobs that are not reachable from any ref from the '
+            +'term cache, implies --term-cache',
+        action='store_true',
+        dest='prune_cache'
+    )
+
     args = parser.parse_args()
-    main(args.output)
+    term_cache_file = None
+    if args.term_cache or args.prune_cache:
+        term_cache_file = args.cache_file or default_term_cache_file()
+    main(args.output, args.rev, args.embedding, args.jobs, term_cache_file,
+        args.prune_cache)
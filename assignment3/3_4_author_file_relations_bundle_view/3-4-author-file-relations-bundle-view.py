@@ -95,15 +95,25 @@ class Edge():
         )
 
 
-def run_command(command, multiline_output=True, separator="\n"):
+def stream_command(command, separator):
+    # yields the output of the command split at the separator, record by
+    # record while the command is still running instead of buffering the whole
+    # output; a record starts at a line beginning with the separator
     command = command if isinstance(command, list) else command.split()
     process = subprocess.Popen(
         command,
         stdout=subprocess.PIPE
     )
-    output, _ = process.communicate()
-    text = output.decode()
-    return text.split(separator) if multiline_output else text.strip()
+    record = []
+    for line in process.stdout:
+        line = line.decode()
+        if line.startswith(separator):
+            yield "".join(record)
+            record = [line[len(separator):]]
+        else:
+            record.append(line)
+    yield "".join(record)
+    process.wait()
 
 
 def flatMap(f, items):
@@ -123,13 +133,31 @@ def mean(l):
     return float(sum(l) / max(len(l), 1))
 
 
-def parse_raw_commit(raw_commit, value_sep, filter_files):
+def resolve_renames(entries, aliases):
+    # maps the `--name-status` entries of a commit to the current paths of the
+    # files, `aliases` maps historic paths to current ones and is updated with
+    # the renames of the commit, so the history has to be walked backwards
+    filenames = []
+    renamed = {}
+    for entry in entries:
+        parts = entry.split("\t")
+        filename = aliases.get(parts[-1], parts[-1])
+        filenames.append(filename)
+        if parts[0].startswith("R") and len(parts) == 3:
+            renamed[parts[1]] = filename
+    aliases.update(renamed)
+    return filenames
+
+
+def parse_raw_commit(raw_commit, value_sep, filter_files, aliases=None):
     if not raw_commit:
         return None
     lines = raw_commit.split("\n")
     author, timestamp = lines[0].split(value_sep)
     timestamp = date.fromtimestamp(int(timestamp))
     filenames = [lines[j] for j in range(1, len(lines)) if lines[j]]
+    if aliases is not None:
+        filenames = resolve_renames(filenames, aliases)
     if filter_files:
         filenames = list(filter(
             lambda f: re.fullmatch(sourcecode_pattern, f),
@@ -152,7 +180,7 @@ def parse_raw_commit(raw_commit, value_sep, filter_files):
     )
 
 
-def load_all_commits(filter_files):
+def load_all_commits(filter_files, follow_renames=False):
     commit_sep = "==="
     value_sep = ";"
     command = [
@@ -160,9 +188,15 @@ def load_all_commits(filter_files):
         "--pretty=format:" + commit_sep + "%ae" + value_sep + "%at",
         "--no-merges"
     ]
-    results = run_command(command, multiline_output=True, separator=commit_sep)
+    # with renames the files are keyed by their current path, git log walks
+    # the history backwards as required by `resolve_renames`
+    aliases = None
+    if follow_renames:
+        command[2:3] = ["--name-status", "-M"]
+        aliases = {}
+    results = stream_command(command, commit_sep)
     return list(partialMap(
-        lambda result: parse_raw_commit(result, value_sep, filter_files),
+        lambda result: parse_raw_commit(result, value_sep, filter_files, aliases),
         results
     ))
 
@@ -215,6 +249,78 @@ def calc_mtbc(commits):
     return mtbc
 
 
+def calc_metrics_vectorized(commits):
+    try:
+        import numpy as np
+    except ImportError:
+        print("ERROR - the vectorized mode requires numpy", file=sys.stderr)
+        print("      - install it using pip via 'pip3 install numpy'", file=sys.stderr)
+        sys.exit(1)
+
+    # flat edge arrays (commit id, module id, author id) in git log order
+    module_names = sorted(set(flatMap(lambda c: c.filenames, commits)))
+    author_names = sorted(set(commit.author for commit in commits))
+    module_index = {name: i for i, name in enumerate(module_names)}
+    author_index = {name: i for i, name in enumerate(author_names)}
+    n_commits = len(commits)
+    commit_days = np.array(
+        [commit.timestamp.toordinal() for commit in commits],
+        dtype=np.int64
+    )
+    commit_authors = np.array(
+        [author_index[commit.author] for commit in commits],
+        dtype=np.int64
+    )
+    edge_commits = np.repeat(
+        np.arange(n_commits),
+        [len(commit.filenames) for commit in commits]
+    )
+    edge_modules = np.array(
+        [module_index[f] for commit in commits for f in commit.filenames],
+        dtype=np.int64
+    )
+
+    # mean of the deltas between the consecutive commits of each group,
+    # `group_ids` has to be sorted with the commits in git log order
+    def grouped_mtbc(group_ids, commit_ids, n_groups):
+        counts = np.bincount(group_ids, minlength=n_groups)
+        same_group = group_ids[1:] == group_ids[:-1]
+        days = commit_days[commit_ids]
+        deltas = (days[:-1] - days[1:])[same_group]
+        delta_sums = np.bincount(
+            group_ids[1:][same_group],
+            weights=deltas,
+            minlength=n_groups
+        )
+        return [
+            float(delta_sums[i] / (counts[i] - 1)) if counts[i] > 2 else 0
+            for i in range(n_groups)
+        ]
+
+    # module commits, a commit is counted once per module
+    pairs = np.unique(edge_modules * n_commits + edge_commits)
+    module_mtbc = grouped_mtbc(
+        pairs // n_commits, pairs % n_commits, len(module_names)
+    )
+    module_noc = np.bincount(edge_modules, minlength=len(module_names))
+    modules = [
+        Module(name, int(module_noc[i]), module_mtbc[i])
+        for i, name in enumerate(module_names)
+    ]
+
+    order = np.argsort(commit_authors, kind="stable")
+    author_mtbc = grouped_mtbc(commit_authors[order], order, len(author_names))
+    author_noc = np.bincount(
+        commit_authors[edge_commits],
+        minlength=len(author_names)
+    )
+    authors = [
+        Author(name, int(author_noc[i]), author_mtbc[i])
+        for i, name in enumerate(author_names)
+    ]
+    return authors, modules
+
+
 def serialize_all(items):
     return list(map(lambda i: i.serialize(), items))
 
@@ -244,9 +350,15 @@ def output_graph(authors, modules, edges, unique_edges=False):
         print(edge)
 
 
-def main(filter_files, unique_edges):
-    commits = load_all_commits(filter_files)
+def main(filter_files, unique_edges, follow_renames, vectorized):
+    commits = load_all_commits(filter_files, follow_renames)
     edges = collect_edges(commits)
+
+    if vectorized:
+        authors, modules = calc_metrics_vectorized(commits)
+        output_graph(authors, modules, edges, unique_edges=unique_edges)
+        return
+
     author_names, module_names = collect_nodes(commits)
 
     modules = []
@@ -292,5 +404,19 @@ if __name__ == "__main__":
         dest='unique_edges'
     )
 
+    parser.add_argument('--follow-renames', '-m',
+        help='track files across renames detected by `git log -M`, so each '
+            +'module is keyed by its current path',
+        action='store_true',
+        dest='follow_renames'
+    )
+
+    parser.add_argument('--vectorized', '-v',
+        help='compute the NoC and MTBC of all nodes at once with numpy',
+        action='store_true',
+        dest='vectorized'
+    )
+
     args = parser.parse_args()
-    main(args.filter_files, args.unique_edges)
+    main(args.filter_files, args.unique_edges, args.follow_renames,
+        args.vectorized)
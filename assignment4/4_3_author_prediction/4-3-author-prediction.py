@@ -2,6 +2,8 @@
 import sys
 import os
 import subprocess
+import re
+from multiprocessing import Pool
 
 try:
     import numpy as np
@@ -35,6 +37,28 @@ author_embeddings_filename = "AuthorEmbeddings.joblib"
 encoding = 'ascii'
 token_pattern = r'\w\w+'
 random_seed = 89715348
+# diff ingestion settings, the history is split into chunks of commits whose
+# diffs are generated and filtered in parallel
+ingest_jobs = os.cpu_count() or 1
+commits_per_chunk = 500
+commit_sep = "~~==~~"
+git_exclude_prefixes = [
+    "diff",
+    "index", "mode", "new", "old", "deleted", "copy",
+    "rename", "similarity", "dissimilarity",
+    "---", "+++",
+    "@@", "@@@"
+]
+# a changed line stripped of (latin1) whitespace, unless it is empty or starts
+# with one of the git diff header prefixes
+whitespace = rb'\t\x0b\x0c\r\x1c-\x1f \x85\xa0'
+changed_line_pattern = re.compile(
+    rb'^[' + whitespace + rb']*'
+    + rb'((?!' + b'|'.join(re.escape(p.encode()) for p in git_exclude_prefixes) + rb')'
+    + rb'[^\n' + whitespace + rb'](?:[^\n]*[^\n' + whitespace + rb'])?)'
+    + rb'[' + whitespace + rb']*$',
+    re.MULTILINE
+)
 
 
 def log(msg, *args):
@@ -108,15 +132,14 @@ def plot_voronoi_neighbors(voro, query_points, neighbors):
     plt.show()
 
 
-def run_command(command, multiline_output=True, separator="\n"):
-    command = command if isinstance(command, list) else command.split()
+def read_command(command, input=None):
     process = subprocess.Popen(
         command,
+        stdin=subprocess.PIPE if input is not None else None,
         stdout=subprocess.PIPE
     )
-    output, _ = process.communicate()
-    text = output.decode('latin1')
-    return text.split(separator) if multiline_output else text.strip()
+    output, _ = process.communicate(input)
+    return output
 
 
 def read_file(filename):
@@ -135,50 +158,48 @@ def read_file(filename):
             return
 
 
-def startswith_none_of(exclude_patterns, text):
-    return not any(
-        text.strip().startswith(pattern) for pattern in exclude_patterns
+def load_chunk(hashes):
+    # changed lines of the given commits, without the git diff headers
+    output = read_command(
+        [
+            "git", "log", "--no-walk=unsorted", "--stdin", "--no-color",
+            "--cc", "-U0", "--pretty=format:" + commit_sep + "%ae"
+        ],
+        input="\n".join(hashes).encode()
     )
+    changes = []
+    for commit in output.split(commit_sep.encode()):
+        if not commit:
+            continue
+        author, _, diff = commit.partition(b"\n")
+        lines = changed_line_pattern.findall(diff)
+        changes.append((
+            author.decode('latin1'),
+            [line.decode('latin1') for line in lines]
+        ))
+    return changes
 
 
 def load_changes():
-    commit_sep = "~~==~~"
-    command = [
-        "git", "log", "--no-merges", "--no-color", "--cc", "-U0",
-        "--pretty=format:" + commit_sep + "%ae"
-    ]
+    command = ["git", "rev-list", "--no-merges", "HEAD"]
     if testing_filter:
         command.append(testing_filter)
 
     log("Running command:", " ".join(command))
-    result = run_command(command, multiline_output=True, separator=commit_sep)
-
-    git_exclude_prefixes = [
-        "diff",
-        "index", "mode", "new", "old", "deleted", "copy",
-        "rename", "similarity", "dissimilarity",
-        "---", "+++",
-        "@@", "@@@"
+    hashes = read_command(command).split()
+    chunks = [
+        [h.decode() for h in hashes[i:i + commits_per_chunk]]
+        for i in range(0, len(hashes), commits_per_chunk)
     ]
 
-    log("Received results, building dict")
+    log("Loading the changes of", len(hashes), "commits in", len(chunks), "chunks")
     changes_per_author = {}
-    for commit in result:
-        if not commit:
-            continue
-        lines = commit.split("\n")
-        author = lines[0]
-        lines = filter(
-            lambda x: x and startswith_none_of(git_exclude_prefixes, x),
-            map(
-                lambda x: x.strip(),
-                lines[1:]
-            )
-        )
-        if author not in changes_per_author:
-            changes_per_author[author] = []
-        for line in lines:
-            changes_per_author[author].append(line)
+    with Pool(ingest_jobs) as pool:
+        for changes in pool.imap(load_chunk, chunks):
+            for author, lines in changes:
+                if author not in changes_per_author:
+                    changes_per_author[author] = []
+                changes_per_author[author].extend(lines)
     log("Dictionary created, authors:", len(changes_per_author))
     return changes_per_author
 
@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# commands that are counted when spawned by a benchmarked script
+counted_commands = [
+    "git", "find", "sort", "uniq", "wc", "grep", "sed", "awk", "head", "tail",
+    "date"
+]
+# file extensions of the synthetic files, C/C++ for 2-1 and TypeScript for
+# the scripts of assignment 3
+synthetic_extensions = [".cpp", ".h", ".ts", ".tsx"]
+directories_per_level = 8
+
+
+# name -> (command, extra arguments), `{output}` is replaced by a PDF file in
+# the work dir and `{root_commit}` by the first commit of the repository
+benchmarks = {
+    "2-1-per-module-metrics": (
+        ["python3", "assignment2/2_1_per_module_metrics/2-1-per-module-metrics.py"],
+        []
+    ),
+    "2-1-per-module-metrics-single-pass": (
+        ["python3", "assignment2/2_1_per_module_metrics/2-1-per-module-metrics.py"],
+        ["--single-pass"]
+    ),
+    "3-1-de-facto-coupling-matrix": (
+        ["python3", "assignment3/3_1_de_facto_coupling_matrix/3-1-de-facto-coupling-matrix.py"],
+        ["{output}"]
+    ),
+    "3-4-author-file-relations-bundle-view": (
+        ["python3", "assignment3/3_4_author_file_relations_bundle_view/3-4-author-file-relations-bundle-view.py"],
+        ["--filter-files"]
+    ),
+    "findStaleCode": (
+        ["python3", "assignment1/1_4_repository_mining/findStaleCode.py"],
+        ["--from-ref", "{root_commit}"]
+    ),
+    "repository-mining": (
+        ["bash", "assignment1/1_4_repository_mining/repository-mining.sh"],
+        []
+    ),
+}
+
+
+def log(msg, *args):
+    print(msg, *args, file=sys.stderr)
+
+
+def synthetic_filenames(n_files):
+    filenames = []
+    for i in range(n_files):
+        path = "src/dir{}/sub{}".format(
+            i % directories_per_level,
+            (i // directories_per_level) % directories_per_level
+        )
+        extension = synthetic_extensions[i % len(synthetic_extensions)]
+        filenames.append("{}/file{}{}".format(path, i, extension))
+    return filenames
+
+
+def synthetic_content(filename, commit, rnd):
+    lines = ["// {} revision {}".format(filename, commit)]
+    for i in range(rnd.randint(5, 40)):
+        lines.append("int vkValue{0}_{1} = computeSomething(value{0}, {1});".format(
+            i, rnd.randint(0, 1000)
+        ))
+    return ("\n".join(lines) + "\n").encode()
+
+
+def fast_import_data(data):
+    return b"data " + str(len(data)).encode() + b"\n" + data + b"\n"
+
+
+# writes the history of the synthetic repository as a `git fast-import` stream,
+# the last commit is dated now so the time windows of the scripts are filled
+def write_fast_import_stream(stream, n_commits, n_files, n_authors, fan_out, seed):
+    rnd = random.Random(seed)
+    filenames = synthetic_filenames(n_files)
+    authors = [
+        ("Author {}".format(i), "author{}@example.com".format(i))
+        for i in range(n_authors)
+    ]
+    # spread the commits over the last two years
+    timestamps = sorted(
+        rnd.randint(0, 2 * 365 * 24 * 3600) for _ in range(n_commits)
+    )
+    offset = int(time.time()) - (timestamps[-1] if timestamps else 0)
+
+    created = set()
+    for commit in range(n_commits):
+        name, email = rnd.choice(authors)
+        timestamp = timestamps[commit] + offset
+        # the first commits create all files, later ones touch up to `fan_out`
+        if len(created) < n_files:
+            touched = filenames[len(created):len(created) + max(fan_out, 1)]
+            created.update(touched)
+        else:
+            touched = rnd.sample(filenames, rnd.randint(1, min(fan_out, n_files)))
+        message = "{} change {}".format(
+            rnd.choice(["fix", "add", "improve", "refactor", "doc", "test"]),
+            commit
+        ).encode()
+
+        stream.write(b"commit refs/heads/master\n")
+        identity = "{} <{}> {} +0000\n".format(name, email, timestamp).encode()
+        stream.write(b"author " + identity)
+        stream.write(b"committer " + identity)
+        stream.write(fast_import_data(message))
+        for filename in touched:
+            stream.write(b"M 100644 inline " + filename.encode() + b"\n")
+            stream.write(fast_import_data(
+                synthetic_content(filename, commit, rnd)
+            ))
+        stream.write(b"\n")
+
+
+def create_repository(path, n_commits, n_files, n_authors, fan_out, seed):
+    if os.path.isdir(os.path.join(path, ".git")):
+        log("Reusing synthetic repository", path)
+        return
+    log("Creating synthetic repository", path)
+    os.makedirs(path)
+    subprocess.run(["git", "init", "-q", path], check=True)
+    process = subprocess.Popen(
+        ["git", "fast-import", "--quiet"],
+        stdin=subprocess.PIPE,
+        cwd=path
+    )
+    write_fast_import_stream(
+        process.stdin, n_commits, n_files, n_authors, fan_out, seed
+    )
+    process.stdin.close()
+    if process.wait() != 0:
+        raise RuntimeError("git fast-import failed for " + path)
+    subprocess.run(["git", "checkout", "-q", "-f", "master"], check=True, cwd=path)
+
+
+# directory with wrappers for the counted commands, which append the command
+# name to the file in $BENCHMARK_SPAWN_LOG before executing the real binary
+def create_spawn_counters(directory):
+    for command in counted_commands:
+        executable = shutil.which(command)
+        if not executable:
+            continue
+        wrapper = os.path.join(directory, command)
+        with open(wrapper, "w") as f:
+            f.write("#!/bin/sh\n")
+            f.write('echo {} >> "$BENCHMARK_SPAWN_LOG"\n'.format(command))
+            f.write('exec {} "$@"\n'.format(executable))
+        os.chmod(wrapper, 0o755)
+
+
+def count_spawns(spawn_log):
+    counts = {}
+    if os.path.exists(spawn_log):
+        with open(spawn_log) as f:
+            for line in f:
+                command = line.strip()
+                counts[command] = counts.get(command, 0) + 1
+    return counts
+
+
+def process_children():
+    # parent pid -> child pids of all running processes
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open("/proc/{}/stat".format(entry)) as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # the command name in parentheses may contain spaces
+        ppid = int(stat[stat.rindex(")") + 2:].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+    return children
+
+
+def peak_rss_of_tree(pid):
+    # sum of the peak RSS (VmHWM) of a process and its running descendants,
+    # the VmHWM of a process starts fresh at exec, unlike ru_maxrss which
+    # inherits the high-water mark of the forking benchmark harness
+    children = process_children()
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        pending.extend(children.get(current, []))
+        try:
+            with open("/proc/{}/status".format(current)) as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        total += int(line.split()[1])
+                        break
+        except OSError:
+            pass
+    return total
+
+
+def run_benchmark(command, cwd, env, timeout):
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        command,
+        cwd=cwd,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    timed_out = False
+    deadline = start + timeout if timeout else None
+    # the memory of the script is sampled while it runs, so subprocesses
+    # that start and end between two samples are missed
+    peak_rss_kb = 0
+    while True:
+        peak_rss_kb = max(peak_rss_kb, peak_rss_of_tree(process.pid))
+        pid, status = os.waitpid(process.pid, os.WNOHANG)
+        if pid:
+            break
+        if deadline and not timed_out and time.perf_counter() > deadline:
+            process.kill()
+            timed_out = True
+        time.sleep(0.01)
+    wall_time = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return {
+        "wall_time": wall_time,
+        # None if the script ended before the first sample
+        "peak_rss_kb": peak_rss_kb or None,
+        "exit_code": process.returncode,
+        "timed_out": timed_out
+    }
+
+
+def environment_info():
+    git_version = subprocess.run(
+        ["git", "--version"],
+        stdout=subprocess.PIPE
+    ).stdout.decode().strip()
+    return {
+        "python": platform.python_version(),
+        "git": git_version,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count()
+    }
+
+
+def main(args):
+    selected = args.scripts or list(benchmarks)
+    unknown = [name for name in selected if name not in benchmarks]
+    if unknown:
+        log("Unknown benchmarks:", ", ".join(unknown))
+        sys.exit(1)
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="mining-benchmark-")
+    os.makedirs(work_dir, exist_ok=True)
+    counter_dir = tempfile.mkdtemp(prefix="spawn-counters-")
+    create_spawn_counters(counter_dir)
+
+    runs = []
+    configurations = itertools.product(
+        args.commits, args.files, args.authors, args.fan_out
+    )
+    for n_commits, n_files, n_authors, fan_out in configurations:
+        repository = {
+            "commits": n_commits,
+            "files": n_files,
+            "authors": n_authors,
+            "fan_out": fan_out,
+            "seed": args.seed
+        }
+        path = os.path.join(work_dir, "synthetic-c{}-f{}-a{}-o{}-s{}".format(
+            n_commits, n_files, n_authors, fan_out, args.seed
+        ))
+        create_repository(path, n_commits, n_files, n_authors, fan_out, args.seed)
+        root_commit = subprocess.run(
+            ["git", "rev-list", "--max-parents=0", "HEAD"],
+            stdout=subprocess.PIPE,
+            cwd=path
+        ).stdout.decode().split()[0]
+
+        for name in selected:
+            command, extra_args = benchmarks[name]
+            output = os.path.join(work_dir, name + ".pdf")
+            command = [command[0], os.path.join(repo_root, command[1])] + [
+                arg.format(output=output, root_commit=root_commit)
+                for arg in extra_args
+            ]
+
+            result = None
+            subprocesses = {}
+            for _ in range(args.repeat):
+                spawn_log = os.path.join(counter_dir, "spawns.log")
+                if os.path.exists(spawn_log):
+                    os.remove(spawn_log)
+                env = dict(os.environ)
+                env["PATH"] = counter_dir + os.pathsep + env.get("PATH", "")
+                env["BENCHMARK_SPAWN_LOG"] = spawn_log
+
+                log("Running", name, "on", os.path.basename(path))
+                current = run_benchmark(command, path, env, args.timeout)
+                subprocesses = count_spawns(spawn_log)
+                # keep the fastest run and the highest memory peak
+                if result is None:
+                    result = current
+                else:
+                    result["wall_time"] = min(result["wall_time"], current["wall_time"])
+                    result["peak_rss_kb"] = max(
+                        result["peak_rss_kb"] or 0, current["peak_rss_kb"] or 0
+                    ) or None
+                    result["exit_code"] = result["exit_code"] or current["exit_code"]
+                    result["timed_out"] = result["timed_out"] or current["timed_out"]
+
+            result.update({
+                "script": name,
+                "command": command,
+                "repository": repository,
+                "repeat": args.repeat,
+                "subprocesses": subprocesses,
+                "subprocess_total": sum(subprocesses.values())
+            })
+            runs.append(result)
+
+    shutil.rmtree(counter_dir)
+    if not args.work_dir:
+        # the repositories of a temp work dir can't be reused by a later run
+        shutil.rmtree(work_dir)
+        log("Removed", work_dir)
+    report = {
+        "created": datetime.now().isoformat(),
+        "environment": environment_info(),
+        "runs": runs
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    log("Report saved to", args.output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the repository mining scripts on synthetic "
+            + "git repositories. Every combination of the given repository "
+            + "sizes is generated and measured."
+    )
+    parser.add_argument('output',
+        type=str,
+        nargs='?',
+        help='output filename of the JSON report',
+        default='benchmark-report.json'
+    )
+    parser.add_argument('--commits',
+        type=int,
+        nargs='+',
+        help='number of commits of the synthetic repositories',
+        default=[1000]
+    )
+    parser.add_argument('--files',
+        type=int,
+        nargs='+',
+        help='number of files of the synthetic repositories',
+        default=[200]
+    )
+    parser.add_argument('--authors',
+        type=int,
+        nargs='+',
+        help='number of authors of the synthetic repositories',
+        default=[10]
+    )
+    parser.add_argument('--fan-out',
+        type=int,
+        nargs='+',
+        help='maximum number of files changed by one commit',
+        default=[5],
+        dest='fan_out'
+    )
+    parser.add_argument('--seed',
+        type=int,
+        help='random seed of the repository generator',
+        default=89715348
+    )
+    parser.add_argument('--scripts',
+        type=str,
+        nargs='+',
+        help='benchmarks to run (default: all), one of: ' + ", ".join(benchmarks)
+    )
+    parser.add_argument('--repeat',
+        type=int,
+        help='number of runs per script, the fastest one is reported',
+        default=1
+    )
+    parser.add_argument('--timeout',
+        type=float,
+        help='kill a script after this many seconds'
+    )
+    parser.add_argument('--work-dir',
+        type=str,
+        help='directory for the synthetic repositories, existing ones are '
+            + 'reused (default: a new temp dir that is removed afterwards)',
+        dest='work_dir'
+    )
+
+    args = parser.parse_args()
+    main(args)